@@ -1,7 +1,7 @@
 #
 # MIT License
 #
-# (C) Copyright 2018-2023 Hewlett Packard Enterprise Development LP
+# (C) Copyright 2018-2023, 2026 Hewlett Packard Enterprise Development LP
 #
 # Permission is hereby granted, free of charge, to any person obtaining a
 # copy of this software and associated documentation files (the "Software"),
@@ -24,36 +24,57 @@
 """
 Cray Image Management Service ImsHelper Class
 """
+import base64
 import hashlib
 import io
 import json
 import logging
-import sys
-import tempfile
-from datetime import datetime
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from http.client import HTTPConnection
 from time import sleep
 from typing import Dict, List, Optional
-from urllib.parse import urlparse
+from urllib.parse import quote, urlparse
 
-from importlib.metadata import version
+from importlib.metadata import PackageNotFoundError, version
 
-# CASMCMS-4926: Adjust import path while using this library to find
-# provided, version pinned libraries outside of the context of the Base OS
-# installed locations. Insert at position 0 so provided source is always
-# preferred; this allows fallback to the nominal system locations once
-# the base OS provided RPM content reaches parity.
-sys.path.insert(0, '/opt/cray/crayctl/lib/python2.7/site-packages')
+import boto3
+import requests
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError, ConnectionError as BotoConnectionError, \
+    HTTPClientError, IncompleteReadError
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 
-# pylint: disable=wrong-import-position
-import boto3  # noqa: E402
-import requests  # noqa: E402
-from botocore.exceptions import ClientError  # noqa: E402
-from requests.adapters import HTTPAdapter  # noqa: E402
-from requests.packages.urllib3.util.retry import Retry  # noqa: E402
+LOGGER = logging.getLogger(__name__)
 
-# pylint: enable=wrong-import-position
+# Looked up once; reading distribution metadata scans sys.path
+try:
+    MODULE_VERSION = version('ims-python-helper')
+except PackageNotFoundError:
+    MODULE_VERSION = 'unknown'
 
-LOGGER = logging.getLogger(__name__)
+# http.client sends request bodies in 8 KiB blocks, which keeps S3 upload
+# threads contending for the GIL between small socket writes. Setting
+# IMS_HELPER_LARGE_WRITE_BUF raises the block size for every HTTPConnection
+# in the process; each concurrent S3 connection then uses ~1 MiB of memory.
+HTTP_WRITE_BUFFER_SIZE = 1024 * 1024
+
+
+def _enlarge_http_write_buffer(blocksize=HTTP_WRITE_BUFFER_SIZE):
+    """ Raise the default http.client.HTTPConnection blocksize """
+    HTTPConnection.__init__.__defaults__ = tuple(
+        blocksize if default == 8192 else default
+        for default in HTTPConnection.__init__.__defaults__
+    )
+
+
+if os.environ.get('IMS_HELPER_LARGE_WRITE_BUF', '').lower() in ('1', 'true', 'on', 'yes', 't'):
+    _enlarge_http_write_buffer()
 
 DEFAULT_IMS_API_URL = 'https://api-gw-service-nmn.local/apis/ims'
 
@@ -63,6 +84,75 @@ SQUASHFS_ARTIFACT_TYPE = 'application/vnd.cray.image.rootfs.squashfs'
 DEBUG_KERNEL_ARTIFACT_TYPE = 'application/vnd.cray.image.debug.kernel'
 BOOT_PARAMS_ARTIFACT_TYPE = 'application/vnd.cray.image.parameters.boot'
 
+# Read size used when hashing artifacts without hashlib.file_digest
+MD5_READ_SIZE = 1024 * 1024
+
+# Default S3 transfer settings for artifact uploads. Large parts keep the
+# number of requests for a multi-GB rootfs low. Artifacts smaller than the
+# multipart threshold are uploaded with a single PUT request.
+S3_MULTIPART_THRESHOLD = 64 * 1024 * 1024
+S3_MULTIPART_CHUNKSIZE = 64 * 1024 * 1024
+S3_MAX_CONCURRENCY = 16
+S3_IO_CHUNKSIZE = 1024 * 1024
+
+# Errors that can come out of an artifact upload, and how often and how
+# long to back off before retrying it. botocore already retries transient
+# failures of each request, so these only cover repeated failures.
+S3_UPLOAD_ERRORS = (ClientError, BotoCoreError, S3UploadFailedError)
+S3_UPLOAD_ATTEMPTS = 5
+S3_UPLOAD_MAX_BACKOFF = 60
+
+# Only these upload errors are retried: broken connections, and S3 throttling
+# or server errors. Others, such as AccessDenied or NoSuchBucket, are raised
+# right away since retrying cannot fix them.
+S3_TRANSIENT_CONNECTION_ERRORS = (BotoConnectionError, HTTPClientError, IncompleteReadError)
+S3_TRANSIENT_ERROR_CODES = frozenset((
+    'InternalError', 'RequestLimitExceeded', 'RequestTimeout', 'ServiceUnavailable',
+    'SlowDown', 'Throttling', 'ThrottlingException', 'TooManyRequestsException',
+))
+
+# Size of the botocore connection pool. Artifacts upload in parallel, each
+# with S3_MAX_CONCURRENCY part uploads, so the botocore default of 10 would
+# force connections (and their TLS sessions) to be discarded and re-opened.
+S3_MAX_POOL_CONNECTIONS = 64
+
+# Name of each image artifact type's S3 object, under the image id
+IMAGE_ARTIFACT_NAMES = {
+    SQUASHFS_ARTIFACT_TYPE: 'rootfs',
+    KERNEL_ARTIFACT_TYPE: 'kernel',
+    INITRD_ARTIFACT_TYPE: 'initrd',
+    DEBUG_KERNEL_ARTIFACT_TYPE: 'debug_kernel',
+    BOOT_PARAMS_ARTIFACT_TYPE: 'boot_parameters',
+}
+
+# Maximum number of S3 lookups (image manifests, recipe metadata) made at
+# once when looking for an existing image or recipe with the same artifacts
+MAX_CONCURRENT_LOOKUPS = 8
+
+# Number of seconds presigned artifact upload URLs remain valid
+PRESIGNED_URL_EXPIRATION = 3600
+
+# Size of the connection pool used for IMS API requests
+IMS_POOL_CONNECTIONS = 32
+
+
+class JitteredRetry(Retry):
+    """
+    Retry with full jitter: each backoff is a random time between zero and
+    the usual exponential backoff, so clients that failed together do not
+    all retry together.
+    """
+
+    def get_backoff_time(self):
+        """ Return a full-jitter backoff, picked uniformly from [0, base] for the exponential base backoff """
+        return random.uniform(0, super().get_backoff_time())
+
+
+# Retry policy for IMS API requests. Retry objects are never modified in
+# place (each retry makes a new one), so one instance is shared by all
+# ImsHelper sessions.
+_DEFAULT_RETRIES = JitteredRetry(total=10, backoff_factor=2, status_forcelist=[502, 503, 504])
+
 
 class ImsImagesExistWithName(Exception):
     """A populated image with some given name already exists in IMS."""
@@ -86,20 +176,28 @@ class ImsHelper(object):
 
     def __init__(
             self, ims_url=DEFAULT_IMS_API_URL, session=None, s3_access_key=None,  # pylint: disable=unused-argument
-            s3_secret_key=None, s3_endpoint=None, s3_bucket=None, s3_ssl_verify=None, **_kwargs
+            s3_secret_key=None, s3_endpoint=None, s3_bucket=None, s3_ssl_verify=None,
+            s3_transfer_config=None, s3_config=None, **_kwargs
     ):
-        module_version = version('ims-python-helper')
-        self.ims_url = ims_url.lstrip('/')
+        self.ims_url = ims_url.rstrip('/')
+        self._images_url = f"{self.ims_url}/images"
+        self._jobs_url = f"{self.ims_url}/jobs"
+        self._recipes_url = f"{self.ims_url}/recipes"
         self.session = session or requests.session()
         self.session.headers.update(
-            {'User-Agent': 'ims-python-helper/%s' % module_version}
+            {'User-Agent': 'ims-python-helper/%s' % MODULE_VERSION}
         )
 
-        # Creates a URL retry object and HTTP adapter to use with our session.
+        # Creates an HTTP adapter with our retry policy to use with our session.
         # This allows us to interact with other services in a more resilient
-        # manner.
-        retries = Retry(total=10, backoff_factor=2, status_forcelist=[502, 503, 504])
-        self.session.mount(self.ims_url, HTTPAdapter(max_retries=retries))
+        # manner. The adapter is mounted on the IMS URL only so adapters the
+        # caller mounted on the session for other hosts are left alone; its
+        # pool is sized so concurrent IMS calls keep their connections alive.
+        self.session.mount(self.ims_url, HTTPAdapter(
+            pool_connections=IMS_POOL_CONNECTIONS,
+            pool_maxsize=IMS_POOL_CONNECTIONS,
+            max_retries=_DEFAULT_RETRIES,
+        ))
 
         # Setup the connection to S3
         self.s3_bucket = s3_bucket
@@ -108,21 +206,55 @@ class ImsHelper(object):
             'endpoint_url': s3_endpoint,
             'aws_access_key_id': s3_access_key,
             'aws_secret_access_key': s3_secret_key,
-            'verify': False if not s3_ssl_verify or s3_ssl_verify.lower() in ('false', 'off', 'no', 'f', '0') else s3_ssl_verify  # noqa: E402
+            'verify': False if not s3_ssl_verify or s3_ssl_verify.lower() in ('false', 'off', 'no', 'f', '0') else s3_ssl_verify,  # noqa: E402
+            'config': s3_config or Config(
+                max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                retries={'max_attempts': 10, 'mode': 'adaptive'},
+                tcp_keepalive=True,
+            ),
         }
 
         self.s3_client = boto3.client(*s3args, **s3kwargs)
         self.s3_resource = boto3.resource(*s3args, **s3kwargs)
+        self.s3_transfer_config = s3_transfer_config or TransferConfig(
+            multipart_threshold=S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+            max_concurrency=S3_MAX_CONCURRENCY,
+            io_chunksize=S3_IO_CHUNKSIZE,
+            use_threads=True,
+        )
 
     @staticmethod
     def _md5(filename):
         """ Utility for efficient md5sum of a file """
-        hashmd5 = hashlib.md5()
-        with open(filename, "rb") as afile:
-            for chunk in iter(lambda: afile.read(4096), b""):
+        # Unbuffered, so reads go straight into the digest's own buffer
+        # rather than being copied through a BufferedReader first
+        with open(filename, "rb", buffering=0) as afile:
+            # The whole file is read front to back; let the kernel read ahead
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(afile.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            # hashlib.file_digest (Python 3.11+) runs the read/update loop in C
+            if hasattr(hashlib, 'file_digest'):
+                return hashlib.file_digest(afile, "md5").hexdigest()
+            hashmd5 = hashlib.md5()
+            for chunk in iter(lambda: afile.read(MD5_READ_SIZE), b""):
                 hashmd5.update(chunk)
         return hashmd5.hexdigest()
 
+    def _md5_many(self, filenames):
+        """
+        md5sum several files concurrently. Hashing releases the GIL, so the
+        files are read and hashed in parallel.
+
+        Returns:
+            dict of each filename to its md5sum
+        """
+        filenames = list(dict.fromkeys(filenames))
+        if len(filenames) <= 1:
+            return {filename: self._md5(filename) for filename in filenames}
+        with ThreadPoolExecutor(max_workers=len(filenames)) as executor:
+            return dict(zip(filenames, executor.map(self._md5, filenames)))
+
     def get_image_manifest(self, record: dict) -> Optional[dict]:
         """Get a parsed manifest for an IMS image
 
@@ -139,23 +271,24 @@ class ImsHelper(object):
         if not link:
             return None
 
-        with io.BytesIO() as manifest_buffer:
-            manifest_url = link.get('path')
-            if not manifest_url:
-                return None
-            parsed_manifest_path = urlparse(manifest_url)
-            bucket_name = parsed_manifest_path.netloc
-            manifest_path = parsed_manifest_path.path.strip('/')
+        manifest_url = link.get('path')
+        if not manifest_url:
+            return None
+        parsed_manifest_path = urlparse(manifest_url)
+        bucket_name = parsed_manifest_path.netloc
+        manifest_path = parsed_manifest_path.path.strip('/')
 
-            try:
-                LOGGER.debug("Retrieving manifest; bucket: %s, path: %s",
-                             bucket_name, manifest_path)
-                self.s3_client.download_fileobj(bucket_name, manifest_path, manifest_buffer)
-            except ClientError as err:
-                LOGGER.warning('Could not retrieve manifest from URL "%s"; skipping image (%s)',
-                               manifest_url, err)
-                return None
-            return json.loads(manifest_buffer.getvalue().decode())
+        # The manifest is small, so fetch it with a single GET rather than
+        # through the managed transfer and its thread pool.
+        try:
+            LOGGER.debug("Retrieving manifest; bucket: %s, path: %s",
+                         bucket_name, manifest_path)
+            response = self.s3_client.get_object(Bucket=bucket_name, Key=manifest_path)
+            return json.load(response['Body'])
+        except ClientError as err:
+            LOGGER.warning('Could not retrieve manifest from URL "%s"; skipping image (%s)',
+                           manifest_url, err)
+            return None
 
     def artifacts_match_image_record(
             self,
@@ -166,6 +299,8 @@ class ImsHelper(object):
             initrd_path: Optional[str] = None,
             debug_kernel: Optional[str] = None,
             boot_params: Optional[str] = None,
+            md5sums: Optional[Dict[str, str]] = None,
+            manifest: Optional[dict] = None,
     ) -> bool:
         """Check if all the artifacts match a single image record.
 
@@ -178,46 +313,119 @@ class ImsHelper(object):
             initrd_path: path to the initrd artifact, if provided
             debug_kernel: path to the debug kernel artifact, if provided
             boot_params: path to the kernel boot parameters, if provided
+            md5sums: cache of artifact path to md5sum. Artifacts missing
+                from it are hashed and added, so callers can reuse the
+                checksums across calls and for a following upload.
+            manifest: the image's manifest, if the caller already retrieved
+                it; otherwise it is retrieved from S3
 
         Returns:
             True if the artifacts at the given paths have the same MD5
             checksums listed in the image record, and the name matches,
             or False otherwise.
         """
-        manifest = self.get_image_manifest(record)
+        if manifest is None:
+            manifest = self.get_image_manifest(record)
         if manifest is None:
             return False
 
-        cmp_dict = {'name': name}
-        if rootfs_path:
-            cmp_dict['rootfs'] = self._md5(rootfs_path)
-        if kernel_path:
-            cmp_dict['kernel'] = self._md5(kernel_path)
-        if initrd_path:
-            cmp_dict['initrd'] = self._md5(initrd_path)
-        if debug_kernel:
-            cmp_dict['debug_kernel'] = self._md5(debug_kernel)
-        if boot_params:
-            cmp_dict['boot_params'] = self._md5(boot_params)
-
-        cmp_dict_key_to_artifact_type = {
-            'rootfs': SQUASHFS_ARTIFACT_TYPE,
-            'kernel': KERNEL_ARTIFACT_TYPE,
-            'initrd': INITRD_ARTIFACT_TYPE,
-            'debug_kernel': DEBUG_KERNEL_ARTIFACT_TYPE,
-            'boot_params': BOOT_PARAMS_ARTIFACT_TYPE,
+        artifact_paths = {
+            SQUASHFS_ARTIFACT_TYPE: rootfs_path,
+            KERNEL_ARTIFACT_TYPE: kernel_path,
+            INITRD_ARTIFACT_TYPE: initrd_path,
+            DEBUG_KERNEL_ARTIFACT_TYPE: debug_kernel,
+            BOOT_PARAMS_ARTIFACT_TYPE: boot_params,
         }
+        artifact_paths = {artifact_type: path for artifact_type, path in artifact_paths.items() if path}
+
+        if md5sums is None:
+            md5sums = {}
+
+        # Walk the manifest once, keeping the last artifact of each type
+        manifest_artifacts = {}
+        for artifact in manifest.get('artifacts', []):
+            artifact_type = artifact.get('type')
+            if artifact_type in IMAGE_ARTIFACT_NAMES:
+                manifest_artifacts[artifact_type] = artifact
+
+        # Hashing a rootfs takes a long time, so first rule the image out
+        # by what can be checked cheaply: its name, whether it has the same
+        # kinds of artifacts, and each artifact's size against its S3 object.
+        if record.get('name', name) != name or set(manifest_artifacts) != set(artifact_paths):
+            return False
+        for artifact_type, path in artifact_paths.items():
+            artifact = manifest_artifacts.get(artifact_type)
+            if path not in md5sums and artifact \
+                    and not self._artifact_size_matches(path, artifact.get('link')):
+                LOGGER.debug("Size of %s differs from the %s in image %s",
+                             path, IMAGE_ARTIFACT_NAMES[artifact_type], record.get('id'))
+                return False
+
+        md5sums.update(self._md5_many(
+            path for path in artifact_paths.values() if path not in md5sums
+        ))
+
+        cmp_dict = {'name': name}
+        for artifact_type, path in artifact_paths.items():
+            cmp_dict[artifact_type] = md5sums[path]
 
         manifest_cmp_dict = {'name': name}
-        for key, artifact_type in cmp_dict_key_to_artifact_type.items():
-            for artifact in manifest.get('artifacts', []):
-                if artifact.get('type') == artifact_type:
-                    manifest_cmp_dict[key] = artifact['md5']
+        for artifact_type, artifact in manifest_artifacts.items():
+            manifest_cmp_dict[artifact_type] = artifact['md5']
         return manifest_cmp_dict == cmp_dict
 
+    def _artifact_size_matches(self, path, link):
+        """
+        Check if a local artifact is the same size as the S3 object in an
+        artifact link. Returns True if the sizes cannot be compared, so
+        that the caller falls back to comparing checksums.
+        """
+        if not link or not link.get('path'):
+            return True
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return True
+
+        parsed_path = urlparse(link['path'])
+        try:
+            response = self.s3_client.head_object(
+                Bucket=parsed_path.netloc, Key=parsed_path.path.strip('/')
+            )
+        except ClientError as err:
+            LOGGER.debug("Could not retrieve size of %s: %s", link['path'], err)
+            return True
+        return response['ContentLength'] == size
+
+    @staticmethod
+    def _s3_error_is_transient(err):
+        """
+        Return whether retrying could fix the S3 upload error err. upload_file
+        wraps client errors in an S3UploadFailedError, so those are unwrapped.
+        """
+        if isinstance(err, S3UploadFailedError) and isinstance(err.__context__, ClientError):
+            err = err.__context__
+        if isinstance(err, ClientError):
+            status = err.response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+            code = err.response.get('Error', {}).get('Code')
+            return status >= 500 or status in (408, 429) or code in S3_TRANSIENT_ERROR_CODES
+        return isinstance(err, S3_TRANSIENT_CONNECTION_ERRORS)
+
+    @staticmethod
+    def _artifact_metadata(md5sum, image_id=None, image_name=None, ims_job_id=None):
+        """ S3 object metadata stored with an uploaded artifact """
+        metadata = {'md5sum': md5sum}
+        if image_name:
+            metadata['x-shasta-ims-image-name'] = image_name
+        if image_id:
+            metadata['x-shasta-ims-image-id'] = image_id
+        if ims_job_id:
+            metadata['x-shasta-ims-job-id'] = ims_job_id
+        return metadata
+
     def _artifact_processor(
             self, artifact_type, key, artifact, image_id=None, image_name=None,
-            ims_job_id=None
+            ims_job_id=None, md5sum=None
     ):
         """
         Utility to upload the artifact to S3 and return the manifest.json
@@ -227,11 +435,14 @@ class ImsHelper(object):
         Args:
             artifact_type: MIME-type of the artifact
             key: Key to place the artifact in S3
-            artifact: String path on filesystem of artifact file
+            artifact: String path on filesystem of artifact file, or the
+                contents of the artifact as bytes
 
             image_id: id of IMS image, if artifact is associated with an image
             image_name: name of image, if artifact is associated with an image
             ims_job_id: IMS job id, if artifact is associated with an IMS job
+            md5sum: md5sum of the artifact, if already known by the caller;
+                otherwise it is calculated here
 
         Returns:
             The 1.0 version of the IMS manifest.json file entry for this
@@ -252,45 +463,69 @@ class ImsHelper(object):
             "Preparing to upload: path=%s; image_id=%s", s3_path, image_id
         )
 
-        # Add image metadata to the s3 object, if appropriate
-        md5sum = self._md5(artifact)
-        ExtraArgs = {'Metadata': {'md5sum': md5sum}}
-        if image_name:
-            ExtraArgs['Metadata']['x-shasta-ims-image-name'] = image_name
-        if image_id:
-            ExtraArgs['Metadata']['x-shasta-ims-image-id'] = image_id
-        if ims_job_id:
-            ExtraArgs['Metadata']['x-shasta-ims-job-id'] = ims_job_id
-
-        # Upload the file until it successfully takes. Note: This means we could
-        # be waiting indefinitely for s3 to succeed
-        attempt = 1
-        while True:
-            if attempt <= 300:
-                attempt+=1
+        # Add image metadata to the s3 object, if appropriate. The md5sum has
+        # to be known before the upload starts since it is stored as object
+        # metadata.
+        in_memory = isinstance(artifact, bytes)
+        if not md5sum:
+            md5sum = hashlib.md5(artifact).hexdigest() if in_memory else self._md5(artifact)
+        ExtraArgs = {
+            'Metadata': self._artifact_metadata(md5sum, image_id, image_name, ims_job_id)
+        }
+
+        # Small artifacts are sent with a single PUT whose response carries
+        # the ETag. Larger ones go through the managed multipart transfer,
+        # which does not return it, so the ETag is looked up afterwards.
+        size = len(artifact) if in_memory else os.path.getsize(artifact)
+        small_artifact = size < self.s3_transfer_config.multipart_threshold
+        etag = None
+
+        # Upload the file, backing off exponentially (with jitter) between
+        # attempts. The last error is raised once the attempts run out.
+        for attempt in range(S3_UPLOAD_ATTEMPTS):
             try:
-                response = self.s3_client.upload_file(
-                    artifact, self.s3_bucket, key, ExtraArgs=ExtraArgs
-                )
+                if small_artifact:
+                    with (io.BytesIO(artifact) if in_memory else open(artifact, 'rb')) as body:
+                        response = self.s3_client.put_object(
+                            Bucket=self.s3_bucket, Key=key, Body=body,
+                            ContentMD5=base64.b64encode(bytes.fromhex(md5sum)).decode(),
+                            **ExtraArgs
+                        )
+                    etag = response['ETag']
+                elif in_memory:
+                    self.s3_client.upload_fileobj(
+                        io.BytesIO(artifact), self.s3_bucket, key, ExtraArgs=ExtraArgs,
+                        Config=self.s3_transfer_config
+                    )
+                else:
+                    self.s3_client.upload_file(
+                        artifact, self.s3_bucket, key, ExtraArgs=ExtraArgs,
+                        Config=self.s3_transfer_config
+                    )
                 break
-            except Exception as err:  # pylint: disable=bare-except, broad-except
+            except S3_UPLOAD_ERRORS as err:
                 LOGGER.error("Error uploading %s: %s", key, err)
-                LOGGER.error("Re-attempting in %s seconds..." %(attempt))
-                sleep(attempt)
+                if attempt == S3_UPLOAD_ATTEMPTS - 1 or not self._s3_error_is_transient(err):
+                    raise
+                backoff = min(S3_UPLOAD_MAX_BACKOFF, 2 ** attempt + random.random())
+                LOGGER.error("Re-attempting in %.1f seconds...", backoff)
+                sleep(backoff)
 
         # Retrieve Object ETag
-        try:
-            response = self.s3_client.head_object(
-                Bucket=self.s3_bucket, Key=key
-            )
-        except ClientError as err:
-            LOGGER.error("Error retrieving %s metadata: %s", key, err)
-            raise err
+        if etag is None:
+            try:
+                response = self.s3_client.head_object(
+                    Bucket=self.s3_bucket, Key=key
+                )
+            except ClientError as err:
+                LOGGER.error("Error retrieving %s metadata: %s", key, err)
+                raise err
+            etag = response['ETag']
 
         return {  # 1.0 manifest file schema
             'link': {
                 'path': s3_path,
-                'etag': response['ETag'].replace('"', ''),
+                'etag': etag.replace('"', ''),
                 'type': 's3',
             },
             'type': artifact_type,
@@ -302,35 +537,44 @@ class ImsHelper(object):
         Update the job creation/customization record with the
         resultant_image_id
         """
-        url = '/'.join([self.ims_url, 'jobs', ims_job_id])
+        url = f"{self._jobs_url}/{quote(ims_job_id, safe='')}"
         LOGGER.info(
             "PATCH %s resultant_image_id=%s", ims_job_id, result_id
         )
         resp = self.session.patch(url, json={'resultant_image_id': result_id})
-        LOGGER.debug(resp.json())
         resp.raise_for_status()
-        return resp.json()
+        record = resp.json()
+        LOGGER.debug("%s", record)
+        return record
 
     def _ims_job_patch_job_status(self, ims_job_id, ims_job_status):
         """ Update job creation/customization record with a new status """
-        url = '/'.join([self.ims_url, 'jobs', ims_job_id])
+        url = f"{self._jobs_url}/{quote(ims_job_id, safe='')}"
         LOGGER.info("PATCH %s status=%s", url, ims_job_status)
         resp = self.session.patch(url, json={'status': ims_job_status})
-        LOGGER.debug(resp.json())
         resp.raise_for_status()
-        return resp.json()
+        record = resp.json()
+        LOGGER.debug("%s", record)
+        return record
 
-    def _ims_images_get(self) -> List[Dict]:
-        """Get a list of images from IMS"""
-        url = '/'.join([self.ims_url, 'images'])
-        LOGGER.debug("GET %s", url)
-        resp = self.session.get(url)
+    def _ims_images_get(self, name: Optional[str] = None) -> List[Dict]:
+        """Get a list of images from IMS
+
+        Args:
+            name: if given, ask IMS for only the images with this name.
+                IMS versions that do not support the filter return every
+                image, so callers must still filter the result by name.
+        """
+        url = self._images_url
+        params = {'name': name} if name else None
+        LOGGER.debug("GET %s params=%s", url, params)
+        resp = self.session.get(url, params=params)
         resp.raise_for_status()
         return resp.json()
 
     def _ims_image_get(self, image_id: str) -> Dict:
         """Get a specific image from IMS"""
-        url = '/'.join([self.ims_url, 'images', image_id])
+        url = f"{self._images_url}/{quote(image_id, safe='')}"
         LOGGER.debug("GET %s", url)
         resp = self.session.get(url)
         resp.raise_for_status()
@@ -338,7 +582,7 @@ class ImsHelper(object):
 
     def _ims_image_create(self, name, arch=None):
         """ Create a new image record """
-        url = '/'.join([self.ims_url, 'images'])
+        url = self._images_url
         LOGGER.debug("POST %s name=%s", url, name)
         jsonData = {'name': name}
         if arch != None:
@@ -349,16 +593,17 @@ class ImsHelper(object):
 
     def _ims_image_patch(self, image_id, data):
         """ PATCH an image record with the data provided """
-        url = '/'.join([self.ims_url, 'images', image_id])
+        url = f"{self._images_url}/{quote(image_id, safe='')}"
         LOGGER.info("PATCH %s id=%s, data=%s", url, image_id, data)
         resp = self.session.patch(url, json=data)
-        LOGGER.debug(resp.json())
         resp.raise_for_status()
-        return resp.json()
+        record = resp.json()
+        LOGGER.debug("%s", record)
+        return record
 
     def _ims_image_delete(self, image_id):
         """ Delete IMS image record by id """
-        url = '/'.join([self.ims_url, 'images', image_id])
+        url = f"{self._images_url}/{quote(image_id, safe='')}"
         LOGGER.debug("DELETE %s", url)
         resp = self.session.delete(url)
         resp.raise_for_status()
@@ -395,21 +640,23 @@ class ImsHelper(object):
         """
         if skip_existing:
             matching_uploaded_images = []
-            matching_empty_images = []
+            empty_image = None
             try:
-                existing_images = self._ims_images_get()
+                # The name is checked here too since older IMS versions
+                # ignore the filter and return every image
+                existing_images = self._ims_images_get(name=image_name)
                 for image in existing_images:
-                    if image.get("name") == image_name:
-                        if image.get("link"):
-                            matching_uploaded_images.append(image)
-                        else:
-                            matching_empty_images.append(image)
+                    if image.get("name") != image_name:
+                        continue
+                    if image.get("link"):
+                        matching_uploaded_images.append(image)
+                    else:
+                        # As before, the last empty image is the one used
+                        empty_image = image
                 if matching_uploaded_images:
                     raise ImsImagesExistWithName(image_name, matching_uploaded_images)
-                if matching_empty_images:
-                    LOGGER.info("Found image(s) without artifact links: %s"
-                                ", ".join(i["id"] for i in matching_empty_images))
-                    empty_image = matching_empty_images.pop()
+                if empty_image:
+                    LOGGER.info("Found image without artifact links: %s", empty_image["id"])
                     LOGGER.info("Uploading image artifacts to empty image with ID \"%s\"",
                                 empty_image["id"])
                     return empty_image
@@ -454,14 +701,24 @@ class ImsHelper(object):
             'ims_image_artifacts': []
         }
 
+        # Checksums of the local artifacts, filled in when they are compared
+        # with existing images so that they are not hashed again for upload
+        md5sums = {}
+
         try:
             image_record = self.get_empty_image_record_for_name(image_name, skip_existing, arch=arch)
         except ImsImagesExistWithName as exc:
-            for matching_image_record in exc.image_records:
+            # Fetch the manifests of all the candidate images concurrently;
+            # the local artifacts are then hashed once for all comparisons.
+            lookup_workers = min(MAX_CONCURRENT_LOOKUPS, len(exc.image_records))
+            with ThreadPoolExecutor(max_workers=lookup_workers) as executor:
+                manifests = list(executor.map(self.get_image_manifest, exc.image_records))
+            for matching_image_record, manifest in zip(exc.image_records, manifests):
                 LOGGER.debug("Image with name \"%s\" already exists in IMS with ID \"%s\"; "
                             "checking contents", image_name, matching_image_record['id'])
-                if self.artifacts_match_image_record(matching_image_record, image_name, rootfs, kernel,
-                                                     initrd, debug, boot_parameters):
+                if manifest is not None and self.artifacts_match_image_record(
+                        matching_image_record, image_name, rootfs, kernel, initrd, debug,
+                        boot_parameters, md5sums=md5sums, manifest=manifest):
                     LOGGER.info("Artifacts match checksums listed in manifest for image with name \"%s\"; skipping",
                                    image_name)
                     ret["ims_image_record"] = matching_image_record
@@ -476,69 +733,213 @@ class ImsHelper(object):
         ret["ims_image_record"] = image_record
         image_id = ret["ims_image_record"]["id"]
 
-        # Generate the arguments (artifacts) to be sent for upload
-        key = "{}/%s".format(image_id)
-        to_upload = []
-        if rootfs:
-            to_upload.append((SQUASHFS_ARTIFACT_TYPE, key % 'rootfs', rootfs))  # noqa: E501
-        if kernel:
-            to_upload.append((KERNEL_ARTIFACT_TYPE, key % 'kernel', kernel))  # noqa: E501
-        if initrd:
-            to_upload.append((INITRD_ARTIFACT_TYPE, key % 'initrd', initrd))  # noqa: E501
-        if debug:
-            to_upload.append((DEBUG_KERNEL_ARTIFACT_TYPE, key % 'debug_kernel', debug))  # noqa: E501
-        if boot_parameters:
-            to_upload.append((BOOT_PARAMS_ARTIFACT_TYPE, key % 'boot_parameters',
-                              boot_parameters))  # noqa: E501
+        # Generate the arguments (artifacts) to be sent for upload; each is
+        # stored under the image id with the name IMAGE_ARTIFACT_NAMES gives it
+        artifact_paths = {
+            SQUASHFS_ARTIFACT_TYPE: rootfs,
+            KERNEL_ARTIFACT_TYPE: kernel,
+            INITRD_ARTIFACT_TYPE: initrd,
+            DEBUG_KERNEL_ARTIFACT_TYPE: debug,
+            BOOT_PARAMS_ARTIFACT_TYPE: boot_parameters,
+        }
+        to_upload = [
+            (artifact_type, f"{image_id}/{IMAGE_ARTIFACT_NAMES[artifact_type]}", path)
+            for artifact_type, path in artifact_paths.items() if path
+        ]
         if not to_upload:
             LOGGER.info("No image artifacts supplied for image %s; not uploading anything", image_name)
             return ret
 
-        # Upload the files in series
+        # Upload the files in parallel. The uploads are independent and I/O
+        # bound, and the boto3 client is thread safe. Results are stored by
+        # index so the manifest keeps the same artifact order as before.
         LOGGER.info(
             "Uploading %s files for image_id=%s", len(to_upload), image_id
         )
-        upload_results = []
-        for upload in to_upload:
+        upload_results = [None] * len(to_upload)
+        upload_error = None
+        with ThreadPoolExecutor(max_workers=len(to_upload)) as executor:
+            futures = {
+                executor.submit(
+                    self._artifact_processor, *upload, image_id=image_id,
+                    image_name=image_name, ims_job_id=ims_job_id,
+                    md5sum=md5sums.get(upload[2])
+                ): index
+                for index, upload in enumerate(to_upload)
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    upload_results[index] = future.result()
+                except S3_UPLOAD_ERRORS as err:
+                    LOGGER.error("Failed upload of artifact=%s", to_upload[index][1])
+                    for pending in futures:
+                        pending.cancel()
+                    upload_error = err
+                    break
+
+        # Only clean up once the executor has drained so that an upload that
+        # was still in flight cannot recreate an object after it was removed.
+        if upload_error:
+            self._cleanup_failed_upload(image_id, image_name)
+            raise upload_error
+
+        ret.update(self._image_link_manifest(
+            image_id, upload_results, image_name=image_name, ims_job_id=ims_job_id
+        ))
+        return ret
+
+    def _cleanup_failed_upload(self, image_id, image_name=None):
+        """
+        Remove the IMS image record and any artifacts uploaded for it after
+        a failed upload. The two are independent, so they are removed
+        concurrently. Errors are ignored so that callers can raise the
+        original exception.
+        """
+        LOGGER.info(
+            "Removing image_id=%s; image_name=%s", image_id, image_name
+        )
+
+        def delete_artifacts():
+            bucket = self.s3_resource.Bucket(self.s3_bucket)
+            bucket.objects.filter(Prefix=image_id + "/").delete()
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            cleanups = [
+                executor.submit(self._ims_image_delete, image_id),
+                executor.submit(delete_artifacts),
+            ]
+        for cleanup in cleanups:
             try:
-                upload_results.append(self._artifact_processor(
-                    *upload, image_id=image_id, image_name=image_name,
-                    ims_job_id=ims_job_id
-                ))
-            except ClientError as err:
-                LOGGER.error("Failed upload of artifact=%s", upload[1])
-                LOGGER.info(
-                    "Removing image_id=%s; image_name=%s", image_id, image_name
-                )
+                cleanup.result()
+            except Exception:  # pylint: disable=bare-except, broad-except
+                pass
 
-                # Try to remove the artifacts that were uploaded as well as the
-                # image itself. If either of these fail, raise the original
-                # exception.
-                try:
-                    self._ims_image_delete(image_id)
-                except Exception:  # pylint: disable=bare-except, broad-except
-                    pass
+    def image_upload_artifacts_presigned(
+            self, image_name, artifacts, ims_job_id=None, arch=None,
+            expires_in=PRESIGNED_URL_EXPIRATION
+    ):
+        """
+        Create an image record and presigned S3 URLs that its artifacts can
+        be uploaded to directly, so the artifact contents do not have to pass
+        through this host. Each artifact must be PUT to its URL with the
+        returned headers, which carry the metadata and Content-MD5 the URL was
+        signed with. Once all the artifacts are uploaded, call finalize_image
+        to build the manifest and link it to the image.
 
-                try:
-                    bucket = self.s3_resource.Bucket(self.s3_bucket)
-                    bucket.objects.filter(Prefix=image_id + "/").delete()
-                except Exception:  # pylint: disable=bare-except, broad-except
-                    pass
+        Args:
+            image_name: name of the image
+            artifacts: dict mapping the artifact type of each artifact (e.g.
+                SQUASHFS_ARTIFACT_TYPE) to its md5sum
+            ims_job_id: IMS job id, if the image is associated with an IMS job
+            arch: arch of the image
+            expires_in: number of seconds the URLs remain valid
+
+        Returns:
+            dict with the new 'ims_image_record' and 'uploads', which maps
+            each artifact type to the 'url' and 'headers' for its PUT request
+        """
+        image_record = self._ims_image_create(image_name, arch=arch)
+        image_id = image_record['id']
+
+        uploads = {}
+        for artifact_type, md5sum in artifacts.items():
+            metadata = self._artifact_metadata(md5sum, image_id, image_name, ims_job_id)
+            content_md5 = base64.b64encode(bytes.fromhex(md5sum)).decode()
+            url = self.s3_client.generate_presigned_url(
+                'put_object',
+                Params={
+                    'Bucket': self.s3_bucket,
+                    'Key': f"{image_id}/{IMAGE_ARTIFACT_NAMES[artifact_type]}",
+                    'Metadata': metadata,
+                    'ContentMD5': content_md5,
+                },
+                ExpiresIn=expires_in,
+            )
+            headers = {'x-amz-meta-%s' % k: v for k, v in metadata.items()}
+            headers['Content-MD5'] = content_md5
+            uploads[artifact_type] = {'url': url, 'headers': headers}
+
+        LOGGER.info(
+            "Presigned %s artifact uploads for image_id=%s", len(uploads), image_id
+        )
+        return {
+            'result': 'success',
+            'ims_image_record': image_record,
+            'uploads': uploads,
+        }
+
+    def finalize_image(self, image_id, artifact_types, image_name=None, ims_job_id=None):
+        """
+        Finish an image whose artifacts were uploaded with the URLs from
+        image_upload_artifacts_presigned: build and upload its manifest, link
+        it to the image record and, if this was part of a job, update the job
+        with the new image id.
+
+        Args:
+            image_id: id of the IMS image
+            artifact_types: the types of the artifacts that were uploaded
+            image_name: name of the image, for logging
+            ims_job_id: IMS job id, if the image is associated with an IMS job
 
+        Returns:
+            The same structure as image_upload_artifacts.
+        """
+        artifacts = []
+        for artifact_type in artifact_types:
+            key = f"{image_id}/{IMAGE_ARTIFACT_NAMES[artifact_type]}"
+            try:
+                response = self.s3_client.head_object(Bucket=self.s3_bucket, Key=key)
+            except ClientError as err:
+                LOGGER.error("Error retrieving %s metadata: %s", key, err)
                 raise err
+            artifacts.append({  # 1.0 manifest file schema
+                'link': {
+                    'path': 's3://%s/%s' % (self.s3_bucket, key),
+                    'etag': response['ETag'].replace('"', ''),
+                    'type': 's3',
+                },
+                'type': artifact_type,
+                'md5': response['Metadata']['md5sum'],
+            })
+
+        ret = {'result': 'success'}
+        ret.update(self._image_link_manifest(
+            image_id, artifacts, image_name=image_name, ims_job_id=ims_job_id
+        ))
+        return ret
+
+    def _image_link_manifest(self, image_id, artifacts, image_name=None, ims_job_id=None):
+        """
+        Upload the manifest.json for the uploaded artifacts of an image and
+        link it to the IMS image record. If this was part of a job, the job
+        is updated with the new image id. The image and its artifacts are
+        removed if the manifest cannot be uploaded.
+
+        Args:
+            image_id: id of the IMS image
+            artifacts: manifest entries of the uploaded artifacts, as
+                returned by _artifact_processor
+            image_name: name of the image, for logging
+            ims_job_id: IMS job id, if the image is associated with an IMS job
+
+        Returns:
+            dict with the updated 'ims_image_record', the 'ims_job_record'
+            if ims_job_id was given, and 'ims_image_artifacts'
+        """
+        ret = {}
+        manifest_key = f"{image_id}/manifest.json"
 
         # Build the manifest file with the results from the uploads
         manifest = {
             'version': '1.0',
-            'created': str(datetime.now()),
-            'artifacts': upload_results,
+            'created': datetime.now(timezone.utc).isoformat(),
+            'artifacts': artifacts,
         }
-        with tempfile.NamedTemporaryFile(delete=False) as manifest_file:
-            with open(manifest_file.name, 'w') as f:
-                json.dump(manifest, f, sort_keys=True, indent=4)
-            manifest_file_name = manifest_file.name
+        # The manifest is small, so it is uploaded straight from memory
+        manifest_body = json.dumps(manifest, sort_keys=True, indent=4).encode()
         LOGGER.info(
-            "Generated manifest file for image_id=%s; ims_job_id=%s",
+            "Generated manifest for image_id=%s; ims_job_id=%s",
             image_id, ims_job_id
         )
         LOGGER.debug("%s", manifest)
@@ -546,41 +947,29 @@ class ImsHelper(object):
         # Upload the manifest file itself
         try:
             manifest_meta = self._artifact_processor(
-                'application/json', key % 'manifest.json', manifest_file_name
+                'application/json', manifest_key, manifest_body
             )
-        except ClientError as err:
-            LOGGER.error("Failed to upload %s", key % 'manifest.json')
-            LOGGER.info(
-                "Removing image_id=%s; image_name=%s", image_id, image_name
-            )
-            # Try to remove the artifacts that were uploaded as well as the
-            # image itself. If either of these fail, raise the original
-            # exception.
-            try:
-                self._ims_image_delete(image_id)
-            except Exception:  # pylint: disable=bare-except, broad-except
-                pass
-
-            try:
-                bucket = self.s3_resource.Bucket(self.s3_bucket)
-                bucket.objects.filter(Prefix=image_id + "/").delete()
-            except Exception:  # pylint: disable=bare-except, broad-except
-                pass
-
+        except S3_UPLOAD_ERRORS as err:
+            LOGGER.error("Failed to upload %s", manifest_key)
+            self._cleanup_failed_upload(image_id, image_name)
             raise err
 
-        # Update the image record with the manifest info
-        ret['ims_image_record'] = self._ims_image_patch(
-            image_id, {'link': manifest_meta['link']}
-        )
-
-        # If this was part of a job, update the job with the new image id
-        if ims_job_id:
-            ret['ims_job_record'] = self._ims_job_patch_resultant_image_id(
-                ims_job_id, image_id
+        # Update the image record with the manifest info and, if this was part
+        # of a job, the job with the new image id. IMS has no call that
+        # updates both, but they are separate records so the two PATCH
+        # requests are sent concurrently.
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            image_patch = executor.submit(
+                self._ims_image_patch, image_id, {'link': manifest_meta['link']}
             )
-
-        ret['ims_image_artifacts'] = upload_results + [manifest_meta]
+            job_patch = executor.submit(
+                self._ims_job_patch_resultant_image_id, ims_job_id, image_id
+            ) if ims_job_id else None
+            ret['ims_image_record'] = image_patch.result()
+            if job_patch:
+                ret['ims_job_record'] = job_patch.result()
+
+        ret['ims_image_artifacts'] = artifacts + [manifest_meta]
         return ret
 
     def image_set_job_status(self, ims_job_id, job_status):
@@ -629,7 +1018,21 @@ class ImsHelper(object):
             """
             return 'recipes/{}/recipe.tar.gz'.format(recipe_id)
 
-        def s3_upload_recipe(name, recipe_id, filepath):
+        def uploaded_recipe_md5(recipe):
+            """
+            Helper function to get the md5sum stored with an uploaded recipe
+            in S3, or None if it cannot be retrieved.
+            """
+            try:
+                response = self.s3_client.head_object(
+                    Bucket=self.s3_bucket, Key=artifact_path(recipe['id'])
+                )
+            except ClientError as err:
+                LOGGER.error("Could not retrieve S3 object metadata for recipe %s; %s", recipe['id'], err)
+                return None
+            return response['Metadata'].get('md5sum')
+
+        def s3_upload_recipe(name, recipe_id, filepath, md5sum=None):
             """
             Helper function to upload a recipe to S3 and handle errors of the
             upload failed.
@@ -637,9 +1040,9 @@ class ImsHelper(object):
             try:
                 return self._artifact_processor(
                     'application/x-compressed-tar',
-                    artifact_path(recipe_id), filepath
+                    artifact_path(recipe_id), filepath, md5sum=md5sum
                 )
-            except ClientError as err:
+            except S3_UPLOAD_ERRORS as err:
                 LOGGER.error("Error occurred trying to upload recipe: %s", err)
                 LOGGER.info(
                     "Removing recipe_id=%s; recipe_name=%s", recipe_id, name
@@ -661,27 +1064,40 @@ class ImsHelper(object):
                 name, filepath, distro
             )
 
-        # Get all recipes and filter for the current recipe
-        recipes = self._ims_recipes_get()
+        # Get the recipes with this name. The name is also checked here since
+        # older IMS versions ignore the filter and return every recipe.
+        recipes = self._ims_recipes_get(name=name)
         LOGGER.debug("Existing recipes: %s", recipes)
         filtered_recipes = [r for r in recipes if r['name'] == name]
 
         # At least one recipe matched the given name. Check if any have the same artifacts.
+        # The md5sums of the uploaded recipes are looked up concurrently, and the recipe
+        # archive is hashed at most once, with the result reused for the upload.
+        uploaded_recipes = [recipe for recipe in filtered_recipes if recipe['link']]
+        remote_md5s = {}
+        if uploaded_recipes:
+            with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_LOOKUPS, len(uploaded_recipes))) as executor:
+                remote_md5s = dict(zip(
+                    (recipe['id'] for recipe in uploaded_recipes),
+                    executor.map(uploaded_recipe_md5, uploaded_recipes)
+                ))
+
         empty_recipe = None
+        recipe_md5 = None
         for recipe in filtered_recipes:
             if recipe['link']:
-                try:
-                    recipe_template_dict = {pair['key']: pair['value'] for pair in recipe.get('template_dictionary', [])}
-                    recipe_obj = self.s3_resource.Object(self.s3_bucket, artifact_path(recipe['id']))
-                    if recipe_obj.metadata.get('md5sum') == self._md5(filepath) \
-                            and template_dictionary == recipe_template_dict:
-                        LOGGER.info('Recipe "%s" has already been uploaded (IMS recipe with ID "%s" and template '
-                                    'dictionary %r already exists); nothing to do',
-                                    name, recipe['id'], template_dictionary)
-                        return recipe
-
-                except ClientError as err:
-                    LOGGER.error("Could not retrieve S3 object metadata for recipe %s; %s", recipe['id'], err)
+                remote_md5 = remote_md5s[recipe['id']]
+                if remote_md5 is None:
+                    continue
+                recipe_template_dict = {pair['key']: pair['value'] for pair in recipe.get('template_dictionary', [])}
+                if recipe_md5 is None:
+                    recipe_md5 = self._md5(filepath)
+                if remote_md5 == recipe_md5 \
+                        and template_dictionary == recipe_template_dict:
+                    LOGGER.info('Recipe "%s" has already been uploaded (IMS recipe with ID "%s" and template '
+                                'dictionary %r already exists); nothing to do',
+                                name, recipe['id'], template_dictionary)
+                    return recipe
             else:
                 empty_recipe = recipe
 
@@ -694,7 +1110,7 @@ class ImsHelper(object):
             )
 
             # Go on, upload it
-            recipe_meta = s3_upload_recipe(name, empty_recipe['id'], filepath)
+            recipe_meta = s3_upload_recipe(name, empty_recipe['id'], filepath, recipe_md5)
 
             # Patch the recipe record with the link information
             patch_data = {'link': recipe_meta['link']}
@@ -712,26 +1128,30 @@ class ImsHelper(object):
         LOGGER.info("New recipe created: %s", new_recipe)
 
         # Go on, upload it
-        recipe_meta = s3_upload_recipe(name, new_recipe['id'], filepath)
+        recipe_meta = s3_upload_recipe(name, new_recipe['id'], filepath, recipe_md5)
 
         # Patch the recipe record with the link information
         return self._ims_recipe_patch(
             new_recipe['id'], {'link': recipe_meta['link']}
         )
 
-    def _ims_recipes_get(self):
+    def _ims_recipes_get(self, name=None):
         """
         Get all recipes in IMS
 
-        Args: None
+        Args:
+            name: if given, ask IMS for only the recipes with this name.
+                IMS versions that do not support the filter return every
+                recipe, so callers must still filter the result by name.
         Returns:
             Collection of recipes, which should be a list of dicts
         Raises:
             requests.exceptions.HTTPError
         """
-        url = '/'.join([self.ims_url, 'recipes'])
-        LOGGER.debug("GET %s", url)
-        resp = self.session.get(url)
+        url = self._recipes_url
+        params = {'name': name} if name else None
+        LOGGER.debug("GET %s params=%s", url, params)
+        resp = self.session.get(url, params=params)
         resp.raise_for_status()
         return resp.json()
 
@@ -747,18 +1167,18 @@ class ImsHelper(object):
         Raises:
             requests.exceptions.HTTPError
         """
-        url = '/'.join([self.ims_url, 'recipes'])
+        url = self._recipes_url
 
         if template_dictionary:
             template_dictionary = [{'key': k, 'value': v} for k, v in template_dictionary.items()]
             LOGGER.debug(
                 "POST %s name=%s, linux_distribution=%s, template_dictionary=%s",
-                name, url, linux_distribution, template_dictionary
+                url, name, linux_distribution, template_dictionary
             )
         else:
             LOGGER.debug(
                 "POST %s name=%s, linux_distribution=%s",
-                name, url, linux_distribution
+                url, name, linux_distribution
             )
 
         body = {
@@ -782,7 +1202,7 @@ class ImsHelper(object):
 
     def _ims_recipe_patch(self, recipe_id, data):
         """ PATCH an recipe record with the data provided """
-        url = '/'.join([self.ims_url, 'recipes', recipe_id])
+        url = f"{self._recipes_url}/{quote(recipe_id, safe='')}"
         LOGGER.info("PATCH %s id=%s, data=%s", url, recipe_id, data)
         resp = self.session.patch(url, json=data)
         resp.raise_for_status()
@@ -799,7 +1219,7 @@ class ImsHelper(object):
         Raises:
             requests.exceptions.HTTPError
         """
-        url = '/'.join([self.ims_url, 'recipes', ident])
+        url = f"{self._recipes_url}/{quote(ident, safe='')}"
         LOGGER.debug("DELETE %s", url)
         resp = self.session.delete(url)
         resp.raise_for_status()
@@ -1,7 +1,7 @@
 #
 # MIT License
 #
-# (C) Copyright 2018-2023 Hewlett Packard Enterprise Development LP
+# (C) Copyright 2018-2023, 2026 Hewlett Packard Enterprise Development LP
 #
 # Permission is hereby granted, free of charge, to any person obtaining a
 # copy of this software and associated documentation files (the "Software"),
@@ -37,13 +37,17 @@ import re
 
 import sys
 import time
+from collections import namedtuple
+from functools import lru_cache
 
 # CASMCMS-4926: Adjust import path while using this library to find
 # provided, version pinned libraries outside of the context of the Base OS
-# installed locations. Insert at position 0 so provided source is always
-# preferred; this allows fallback to the nominal system locations once
-# the base OS provided RPM content reaches parity.
-sys.path.insert(0, '/opt/cray/crayctl/lib')
+# installed locations. Only do so where the directory exists, and append it
+# so the standard locations are searched first and every import does not
+# pay for a lookup in it.
+CRAYCTL_LIB_DIR = '/opt/cray/crayctl/lib'
+if os.path.isdir(CRAYCTL_LIB_DIR):
+    sys.path.append(CRAYCTL_LIB_DIR)
 
 # pylint: disable=wrong-import-position
 import oauthlib.oauth2  # noqa: E402
@@ -62,33 +66,45 @@ UUID_PATTERN = \
     re.compile(r"[a-fA-F0-9]{8}-[a-fA-F0-9]{4}-[a-fA-F0-9]{4}-[a-fA-F0-9]{4}-[a-fA-F0-9]{12}")  # noqa: E501
 
 LOGGER = logging.getLogger('ims_python_helper.cli')
+
+# Parsed arguments that configure the CLI itself rather than being passed
+# through to the dispatched ImsHelper method
+_CLI_META_KEYS = frozenset({
+    'cert', 'command', 'ims_url', 'log_level', 'oauth_client_id',
+    'oauth_client_secret', 'resource', 's3_access_key', 's3_bucket',
+    's3_endpoint', 's3_secret_key', 's3_ssl_verify', 'timeout', 'token_url',
+})
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
 # OAuth Defaults
-DEFAULT_OAUTH_ENDPOINT = None
-DEFAULT_OAUTH_CLIENT_ID = None
-DEFAULT_OAUTH_CLIENT_SECRET = None
 DEFAULT_OAUTH_CONFIG_DIR = "/etc/admin-client-auth"
 OAUTH_CONFIG_DIR = os.environ.get(
     "OAUTH_CONFIG_DIR",
     DEFAULT_OAUTH_CONFIG_DIR if os.path.isdir(DEFAULT_OAUTH_CONFIG_DIR) else ""
 )
 
-if OAUTH_CONFIG_DIR:
-    oauth_endpoint_path = os.path.join(OAUTH_CONFIG_DIR, 'endpoint')
-    with open(oauth_endpoint_path) as oauth_endpoint_f:
-        DEFAULT_OAUTH_ENDPOINT = oauth_endpoint_f.read().strip()
-    oauth_client_id_path = os.path.join(OAUTH_CONFIG_DIR, 'client-id')
-    with open(oauth_client_id_path) as auth_client_id_f:
-        DEFAULT_OAUTH_CLIENT_ID = auth_client_id_f.read().strip()
-    oauth_client_secret_path = os.path.join(OAUTH_CONFIG_DIR, 'client-secret')
-    with open(oauth_client_secret_path) as oauth_client_secret_f:
-        DEFAULT_OAUTH_CLIENT_SECRET = oauth_client_secret_f.read().strip()
+OAuthDefaults = namedtuple('OAuthDefaults', ['endpoint', 'client_id', 'client_secret'])
+
+
+@lru_cache(maxsize=1)
+def load_oauth_defaults():
+    """
+    Read the OAuth endpoint, client ID and client secret from OAUTH_CONFIG_DIR,
+    if it is set. The files are only read the first time this is called.
+    """
+    if not OAUTH_CONFIG_DIR:
+        return OAuthDefaults(None, None, None)
+
+    values = []
+    for filename in ('endpoint', 'client-id', 'client-secret'):
+        with open(os.path.join(OAUTH_CONFIG_DIR, filename)) as oauth_config_f:
+            values.append(oauth_config_f.read().strip())
+    return OAuthDefaults(*values)
 
 
 def my_uuid4_regex_type(string_input, pat=UUID_PATTERN):
     """ Validate input is a UUID value """
-    if not pat.match(string_input):
+    if not pat.fullmatch(string_input):
         raise argparse.ArgumentTypeError
     return string_input
 
@@ -189,6 +205,7 @@ def create_parent_parser(program_name):
     """
     Sets up the argparse parent parser and establishes the common options.
     """
+    oauth_defaults = load_oauth_defaults()
     parent_parser = argparse.ArgumentParser(prog=program_name, add_help=False)
     parent_parser.add_argument(
         '-l', '--log-level', type=str, default="WARNING",
@@ -209,15 +226,15 @@ def create_parent_parser(program_name):
         help="Path to System CA Certificate"
     )
     parent_parser.add_argument(
-        '--oauth-client-id', type=str, default=DEFAULT_OAUTH_CLIENT_ID,
+        '--oauth-client-id', type=str, default=oauth_defaults.client_id,
         help="OAuth Client ID"
     )
     parent_parser.add_argument(
-        '--oauth-client-secret', type=str, default=DEFAULT_OAUTH_CLIENT_SECRET,
+        '--oauth-client-secret', type=str, default=oauth_defaults.client_secret,
         help='OAuth Client Secret'
     )
     parent_parser.add_argument(
-        '--token-url', type=str, default=DEFAULT_OAUTH_ENDPOINT,
+        '--token-url', type=str, default=oauth_defaults.endpoint,
         help='Specify the base URL to the OAuth token endpoint; e.g. '
              'https://api-gw-service-nmn.local/keycloak/realms/shasta/protocol/openid-connect/token'  # noqa: E501
     )
@@ -251,8 +268,12 @@ def create_parent_parser(program_name):
     return parent_parser
 
 
+@lru_cache(maxsize=1)
 def create_parser(program_name):
-    """ Creates the parent parser and adds the subparsers """
+    """
+    Creates the parent parser and adds the subparsers. The parser is built
+    once per process; its defaults come from the environment at that time.
+    """
     epilog = '''
     details:
         Detailed usage for subcommands can be displayed by providing
@@ -277,34 +298,9 @@ def create_parser(program_name):
     return parser
 
 
-def log_request(resp, *_args, **_kwargs):  # pylint: disable=unused-argument
-    """
-    This function logs the request.
-
-    Args:
-        resp : The response
-    """
-    if LOGGER.isEnabledFor(logging.DEBUG):
-        LOGGER.debug('\n%s\n%s\n%s\n\n%s',
-                     '-----------START REQUEST-----------',
-                     resp.request.method + ' ' + resp.request.url,
-                     '\n'.join('{}: {}'.format(k, v) for k, v in resp.request.headers.items()),  # noqa: E501
-                     resp.request.body)
-
-
-def log_response(resp, *_args, **_kwargs):  # pylint: disable=unused-argument
-    """
-    This function logs the response.
-
-    Args:
-        resp : The response
-    """
-    if LOGGER.isEnabledFor(logging.DEBUG):
-        LOGGER.debug('\n%s\n%s\n%s\n\n%s',
-                     '-----------START RESPONSE----------',
-                     resp.status_code,
-                     '\n'.join('{}: {}'.format(k, v) for k, v in resp.headers.items()),  # noqa: E501
-                     resp.content)
+def dump_json(obj):
+    """ Format a CLI result the way it is printed """
+    return json.dumps(obj, indent=4, sort_keys=True)
 
 
 def main(program_name, args):
@@ -314,6 +310,13 @@ def main(program_name, args):
     args = parser.parse_args(args)
     logging.basicConfig(level=args.log_level)
 
+    # Resolve the ImsHelper method to dispatch to before setting up a session
+    if not args.resource or not args.command:
+        parser.error("a resource and subcommand are required; e.g. 'image upload_artifacts'")
+    method_name = f"{args.resource}_{args.command}"
+    if not callable(getattr(ImsHelper, method_name, None)):
+        parser.error(f"unknown subcommand '{args.resource} {args.command}'")
+
     ims_helper_kwargs = {
         'ims_url': args.ims_url,
         's3_endpoint': args.s3_endpoint,
@@ -323,7 +326,7 @@ def main(program_name, args):
         's3_bucket': args.s3_bucket,
         'session': create_oauth_session(
             args.oauth_client_id, args.oauth_client_secret, args.cert,
-            args.token_url, args.timeout
+            args.token_url, args.timeout, logger=LOGGER
         ),
     }
 
@@ -333,38 +336,18 @@ def main(program_name, args):
             "to add certificate verification."
         )
 
-    argsmap = dict(vars(args))
-    del argsmap['s3_endpoint']
-    del argsmap['s3_secret_key']
-    del argsmap['s3_access_key']
-    del argsmap['s3_ssl_verify']
-    del argsmap['s3_bucket']
-    del argsmap['cert']
-    del argsmap['command']
-    del argsmap['ims_url']
-    del argsmap['log_level']
-    del argsmap['oauth_client_id']
-    del argsmap['oauth_client_secret']
-    del argsmap['resource']
-    del argsmap['timeout']
-    del argsmap['token_url']
+    argsmap = {key: value for key, value in vars(args).items() if key not in _CLI_META_KEYS}
 
     # Dispatch the command using getattr. Print the json response
     try:
         ims_helper = ImsHelper(**ims_helper_kwargs)
-        print(json.dumps(
-            getattr(ims_helper, "%s_%s" % (args.resource, args.command))(**argsmap),  # noqa: E501
-            indent=4,
-            sort_keys=True
-        ))
+        print(dump_json(getattr(ims_helper, method_name)(**argsmap)))
         return 0
 
     except Exception as e:  # pylint: disable=bare-except, broad-except
-        print(json.dumps(
-            {'result': 'failure', 'error': str(e)},
-            indent=4, sort_keys=True
-        ))
+        print(dump_json({'result': 'failure', 'error': str(e)}))
         return 1
 
 
-sys.exit(main("ims-python-helper", sys.argv[1:]))
+if __name__ == '__main__':
+    sys.exit(main("ims-python-helper", sys.argv[1:]))
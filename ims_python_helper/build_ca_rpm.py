@@ -1,7 +1,7 @@
 #
 # MIT License
 #
-# (C) Copyright 2023 Hewlett Packard Enterprise Development LP
+# (C) Copyright 2023, 2026 Hewlett Packard Enterprise Development LP
 #
 # Permission is hereby granted, free of charge, to any person obtaining a
 # copy of this software and associated documentation files (the "Software"),
@@ -22,10 +22,10 @@
 # OTHER DEALINGS IN THE SOFTWARE.
 #
 
-import errno
 import os
 import shutil
 import subprocess
+import tarfile
 
 RPM_NAME = "cray_ca_cert"
 RPM_VERSION = "1.0.1"
@@ -46,39 +46,47 @@ RPM_BUILD_ROOT = os.path.expanduser("~/rpmbuild/")
 SPECFILE_NAME = "cray_ca_cert.spec"
 SPECFILE_SOURCE_FILE = os.path.join("/mnt/specfile/", SPECFILE_NAME)
 
+
+def _link_or_copy(src, dst):
+    """
+    Hard link src to dst, replacing any existing dst; fall back to copying
+    when they are on different file systems.
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
 def build_ca_rpm():
     os.chdir(os.path.expanduser("~"))
 
     # Create SOURCE archive root and sub directories
-    try:
-        os.makedirs(SOURCE_ARCHIVE_ETC_CRAY_CA_DIR)
-    except OSError as exc:  # Python >2.5
-        if exc.errno == errno.EEXIST and os.path.isdir(SOURCE_ARCHIVE_ETC_CRAY_CA_DIR):
-            pass
-        else:
-            raise
+    os.makedirs(SOURCE_ARCHIVE_ETC_CRAY_CA_DIR, exist_ok=True)
 
-    # Copy CA Certificate into SOURCE directory
+    # Copy CA Certificate into SOURCE directory; this is a real copy since
+    # its permissions are changed
     shutil.copyfile(ETC_CRAY_CA_CERT_FILE, SOURCE_ARCHIVE_ETC_CRAY_CA_CERT_FILE)
     os.chmod(SOURCE_ARCHIVE_ETC_CRAY_CA_CERT_FILE, 0o644)
 
-    # Archive SOURCE archive using tar
-    subprocess.check_call(["tar", "-zcvf", SOURCE_TAR_FILE, "{}-{}".format(RPM_NAME, RPM_VERSION)])
+    # Archive SOURCE archive; it only holds a single certificate, so favor
+    # speed over compression ratio
+    with tarfile.open(SOURCE_TAR_FILE, "w:gz", compresslevel=1) as source_tar:
+        source_tar.add("{}-{}".format(RPM_NAME, RPM_VERSION))
 
-    # Make RPMBUILD directories
-    for rpmbuild_directory in ["{}{}".format(RPM_BUILD_ROOT, subdir) for subdir in
-                               ("SOURCES", "RPMS", "SRPMS", "SPECS", "BUILD", "BUILDROOT")]:
-        try:
-            os.makedirs(os.path.expanduser(rpmbuild_directory))
-        except OSError as exc:  # Python >2.5
-            if exc.errno == errno.EEXIST and os.path.isdir(rpmbuild_directory):
-                pass
-            else:
-                raise
+    # Make the RPMBUILD directories populated here; rpmbuild creates the rest
+    for subdir in ("SOURCES", "SPECS"):
+        os.makedirs(os.path.join(RPM_BUILD_ROOT, subdir), exist_ok=True)
 
-    # Copy source archive and spec file into RPMBUILD directories
-    shutil.copyfile(SOURCE_TAR_FILE, os.path.join(RPM_BUILD_ROOT, "SOURCES", SOURCE_TAR_FILE))
-    shutil.copyfile(SPECFILE_SOURCE_FILE, os.path.join(RPM_BUILD_ROOT, "SPECS", SPECFILE_NAME))
-    subprocess.check_call(["rpmbuild", "-bb", "--target", RPM_ARCHITECTURE, os.path.join(RPM_BUILD_ROOT, "SPECS", SPECFILE_NAME)])
-    shutil.copyfile(os.path.join(RPM_BUILD_ROOT, "RPMS", RPM_ARCHITECTURE, f"cray_ca_cert-{RPM_VERSION}-1.{RPM_ARCHITECTURE}.rpm"),
-                    f"/mnt/ca-rpm/cray_ca_cert-{RPM_VERSION}-1.{RPM_ARCHITECTURE}.rpm")
+    # Link source archive and spec file into RPMBUILD directories
+    _link_or_copy(SOURCE_TAR_FILE, os.path.join(RPM_BUILD_ROOT, "SOURCES", SOURCE_TAR_FILE))
+    _link_or_copy(SPECFILE_SOURCE_FILE, os.path.join(RPM_BUILD_ROOT, "SPECS", SPECFILE_NAME))
+    subprocess.check_call(["rpmbuild", "-bb", "--target", RPM_ARCHITECTURE,
+                           "--define", f"_topdir {RPM_BUILD_ROOT}",
+                           os.path.join(RPM_BUILD_ROOT, "SPECS", SPECFILE_NAME)],
+                          stdout=subprocess.DEVNULL)
+    rpm_file_name = f"cray_ca_cert-{RPM_VERSION}-1.{RPM_ARCHITECTURE}.rpm"
+    _link_or_copy(os.path.join(RPM_BUILD_ROOT, "RPMS", RPM_ARCHITECTURE, rpm_file_name),
+                  os.path.join("/mnt/ca-rpm", rpm_file_name))
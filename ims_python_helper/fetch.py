@@ -1,7 +1,7 @@
 #
 # MIT License
 #
-# (C) Copyright 2023 Hewlett Packard Enterprise Development LP
+# (C) Copyright 2023, 2026 Hewlett Packard Enterprise Development LP
 #
 # Permission is hereby granted, free of charge, to any person obtaining a
 # copy of this software and associated documentation files (the "Software"),
@@ -22,14 +22,19 @@
 # OTHER DEALINGS IN THE SOFTWARE.
 #
 
+import hashlib
 import logging
-from multiprocessing.connection import wait
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 import os
+import pathlib
+import random
 import shutil
 import subprocess
 import sys
 import tarfile
 import tempfile
+import threading
 import time
 
 import jinja2
@@ -37,9 +42,11 @@ import oauthlib.oauth2
 import requests
 import requests_oauthlib
 import yaml
-from ims_python_helper import ImsHelper
+from ims_python_helper import ImsHelper, JitteredRetry
+from ims_python_helper.session import _acquire_initial_token, get_admin_client_auth
 from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
+from requests.packages.urllib3.exceptions import HTTPError as Urllib3HTTPError
 from requests.packages.urllib3.util.retry import Retry
 
 LOGGER = logging.getLogger(__file__)
@@ -48,6 +55,61 @@ logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"))
 IMS_URL = os.environ.get("IMS_URL", "https://api-gw-service-nmn.local/apis/ims")
 CA_CERT = os.environ.get("CA_CERT", "")
 
+# Size of the reads/writes used to copy downloads to disk
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get("DOWNLOAD_CHUNK_SIZE", 8 * 1024 * 1024))
+
+# (connect, read) timeouts, in seconds, for downloads
+DOWNLOAD_TIMEOUT = (5, 60)
+
+# Files at least this large are downloaded as this many concurrent byte
+# ranges when the server supports range requests
+DOWNLOAD_RANGE_THRESHOLD = int(os.environ.get("DOWNLOAD_RANGE_THRESHOLD", 64 * 1024 * 1024))
+DOWNLOAD_RANGE_WORKERS = max(1, int(os.environ.get("DOWNLOAD_RANGE_WORKERS", 8)))
+
+# Downloads are attempted this many times, backing off exponentially between
+# attempts up to DOWNLOAD_MAX_BACKOFF seconds
+DOWNLOAD_ATTEMPTS = 6
+DOWNLOAD_MAX_BACKOFF = 60
+
+# Client errors that are worth retrying a download for; any other 4xx
+# response means the download will not succeed
+DOWNLOAD_RETRYABLE_CLIENT_ERRORS = frozenset((408, 429))
+
+# Connections kept per host by the shared sessions
+SESSION_POOL_CONNECTIONS = 32
+
+# A shared OAuth session gets a new token when its current one expires
+# within this many seconds
+TOKEN_EXPIRY_MARGIN = 60
+
+# Sessions, and the ImsHelper built on them, are shared by every FetchBase in
+# the process so their pooled connections are reused; they are created on
+# first use
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+
+# Files used to signal the state of the job, which must not be left over
+# from an earlier run
+SIGNAL_FILES = ("ready", "complete", "exiting")
+
+# Values used to template recipes
+TEMPLATE_DICTIONARY = "/etc/cray/template_dictionary"
+
+# Parse YAML with libyaml when PyYAML was built against it; it is much faster
+# than the pure Python loader
+YAML_SAFE_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+@lru_cache(maxsize=1)
+def _load_template_dictionary(path, mtime):  # pylint: disable=unused-argument
+    """
+    Parse the template dictionary at path. The result is cached; mtime is only
+    part of the cache key, so the file is parsed again once it changes.
+    """
+    with open(path) as inf:
+        return yaml.load(inf, Loader=YAML_SAFE_LOADER)
+
+
 class FetchBase(object):
 
     def __init__(self):
@@ -61,7 +123,17 @@ class FetchBase(object):
         self.oauth_session = FetchBase.create_oauth_session()
         # Remove insecure session once CASMCMS-4521 (Update IMS to talk via HTTPS to ceph rados gateway) is unblocked
         self.insecure_session = FetchBase.create_session()
-        self.ims_helper = ImsHelper(
+        self.ims_helper = FetchBase._shared_session('ims_helper', self._new_ims_helper)
+        # A single worker sends job status updates to IMS in the order they
+        # were made
+        self._status_executor = ThreadPoolExecutor(max_workers=1)
+
+    def _new_ims_helper(self):
+        """
+        Create and return an ImsHelper using the shared oauth session; it is
+        shared like the sessions, so its boto3 client is only built once
+        """
+        return ImsHelper(
             ims_url=IMS_URL,
             session=self.oauth_session,
             s3_host=os.environ.get('S3_HOST', None),
@@ -77,35 +149,7 @@ class FetchBase(object):
         credential needed to talk to various services behind the api-gateway.
         :return: tuple of oauth_client_id, oauth_client_secret, oauth_client_endpoint
         """
-        default_oauth_client_id = ""
-        default_oauth_client_secret = ""
-        default_oauth_endpoint = ""
-
-        oauth_config_dir = os.environ.get("OAUTH_CONFIG_DIR", "/etc/admin-client-auth")
-        if os.path.isdir(oauth_config_dir):
-            oauth_client_id_path = os.path.join(oauth_config_dir, 'client-id')
-            if os.path.exists(oauth_client_id_path):
-                with open(oauth_client_id_path) as auth_client_id_f:
-                    default_oauth_client_id = auth_client_id_f.read().strip()
-            oauth_client_secret_path = os.path.join(oauth_config_dir, 'client-secret')
-            if os.path.exists(oauth_client_secret_path):
-                with open(oauth_client_secret_path) as oauth_client_secret_f:
-                    default_oauth_client_secret = oauth_client_secret_f.read().strip()
-            oauth_endpoint_path = os.path.join(oauth_config_dir, 'endpoint')
-            if os.path.exists(oauth_endpoint_path):
-                with open(oauth_endpoint_path) as oauth_endpoint_f:
-                    default_oauth_endpoint = oauth_endpoint_f.read().strip()
-
-        oauth_client_id = os.environ.get("OAUTH_CLIENT_ID", default_oauth_client_id)
-        oauth_client_secret = os.environ.get("OAUTH_CLIENT_SECRET", default_oauth_client_secret)
-        oauth_client_endpoint = os.environ.get("OAUTH_CLIENT_ENDPOINT", default_oauth_endpoint)
-
-        if not all([oauth_client_id, oauth_client_secret, oauth_client_endpoint]):
-            LOGGER.error("Invalid oauth configuration. Determine the specific information that "
-                         "is missing or invalid and then re-run the request with valid information.")
-            sys.exit(1)
-
-        return oauth_client_id, oauth_client_secret, oauth_client_endpoint
+        return get_admin_client_auth(LOGGER)
 
     @staticmethod
     def log_request(resp, *args, **kwargs):
@@ -119,13 +163,14 @@ class FetchBase(object):
             LOGGER.debug('\n%s\n%s\n%s\n\n%s',
                          '-----------START REQUEST-----------',
                          resp.request.method + ' ' + resp.request.url,
-                         '\n'.join('{}: {}'.format(k, v) for k, v in list(resp.request.headers.items())),
+                         '\n'.join(f'{k}: {v}' for k, v in resp.request.headers.items()),
                          resp.request.body)
 
     @staticmethod
     def log_response(resp, *args, **kwargs):
         """
-        This function logs the response.
+        This function logs the response. The body of a streamed response is
+        not logged, since reading it here would load all of it into memory.
 
         Args:
             resp : The response
@@ -134,11 +179,70 @@ class FetchBase(object):
             LOGGER.debug('\n%s\n%s\n%s\n\n%s',
                          '-----------START RESPONSE----------',
                          resp.status_code,
-                         '\n'.join('{}: {}'.format(k, v) for k, v in list(resp.headers.items())),
-                         resp.content)
+                         '\n'.join(f'{k}: {v}' for k, v in resp.headers.items()),
+                         '<streamed>' if kwargs.get('stream') else resp.content)
+
+    @staticmethod
+    def _shared_session(name, factory):
+        """
+        Return the shared session with the given name, creating it with factory
+        if needed. The factory runs without holding the lock, since it may fetch
+        a token; if two threads race to create it, the first one installed wins.
+        """
+        with _SESSIONS_LOCK:
+            session = _SESSIONS.get(name)
+        if session is None:
+            created = factory()
+            with _SESSIONS_LOCK:
+                session = _SESSIONS.setdefault(name, created)
+        return session
+
+    @staticmethod
+    def _mount_adapters(session, retries=None):
+        """
+        Creates a URL retry object and HTTP adapter to use with our session;
+        this allows us to interact with services in a more resilient manner.
+        A session whose callers retry on their own can pass its own retries.
+        """
+        if retries is None:
+            retries = JitteredRetry(total=10, backoff_factor=2, status_forcelist=[502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=SESSION_POOL_CONNECTIONS,
+                              pool_maxsize=SESSION_POOL_CONNECTIONS,
+                              max_retries=retries)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+    @staticmethod
+    def _add_logging_hooks(session):
+        """ Log requests and responses, if DEBUG logging is enabled """
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            session.hooks['response'].append(FetchBase.log_request)
+            session.hooks['response'].append(FetchBase.log_response)
 
     @staticmethod
     def create_oauth_session():
+        """
+        Return the process-wide oauth2 python requests session object. Its
+        token is reused until it is about to expire.
+        """
+        session = FetchBase._shared_session('oauth', FetchBase._new_oauth_session)
+        # The token is refreshed without holding the sessions lock, so other
+        # threads can keep using the shared sessions while it is fetched
+        expires_at = session.token.get('expires_at')
+        if expires_at is not None and expires_at - time.time() < TOKEN_EXPIRY_MARGIN:
+            LOGGER.info("OAuth token is about to expire; fetching a new one")
+            FetchBase._fetch_token(session)
+        return session
+
+    @staticmethod
+    def create_session():
+        """
+        Return the process-wide python requests session object
+        """
+        return FetchBase._shared_session('insecure', FetchBase._new_session)
+
+    @staticmethod
+    def _new_oauth_session():
         """
         Create and return an oauth2 python requests session object
         """
@@ -157,51 +261,169 @@ class FetchBase(object):
             },
             token_updater=lambda t: None)
 
-        # Creates a URL retry object and HTTP adapter to use with our session;
-        # this allows us to interact with services in a more resilient manner
-        retries = Retry(total=10, backoff_factor=2, status_forcelist=[502, 503, 504])
-        session.mount("http://", HTTPAdapter(max_retries=retries))
-        session.mount("https://", HTTPAdapter(max_retries=retries))
+        FetchBase._mount_adapters(session)
 
         session.verify = CA_CERT
-        session.hooks['response'].append(FetchBase.log_request)
-        session.hooks['response'].append(FetchBase.log_response)
+        FetchBase._add_logging_hooks(session)
 
-        retries = 0
-        while True:
-            try:
-                session.fetch_token(
-                    token_url=oauth_client_endpoint, client_id=oauth_client_id,
-                    client_secret=oauth_client_secret, timeout=500)
-                return session
+        FetchBase._fetch_token(session)
+        return session
 
-            except RequestException as exc:
-                retries = retries + 1
-                LOGGER.info("Received exception:", exc_info=exc)
-                LOGGER.info("Retrying (%s) in 7 seconds", retries)
-                time.sleep(7)
+    @staticmethod
+    def _fetch_token(session):
+        """
+        Fetch a new token for an oauth2 session from the admin client's
+        token endpoint, with the retries and backoff of session.py.
+        """
+        oauth_client_id, oauth_client_secret, oauth_client_endpoint = FetchBase._get_admin_client_auth()
+        _acquire_initial_token(session, oauth_client_endpoint, oauth_client_id, oauth_client_secret, LOGGER)
 
     @staticmethod
-    def create_session():
+    def _new_session():
         """
         Create and return a python requests session object
         """
         session = requests.Session()
-
-        # Creates a URL retry object and HTTP adapter to use with our session;
-        # this allows us to interact with services in a more resilient manner
-        retries = Retry(total=10, backoff_factor=2, status_forcelist=[502, 503, 504])
-        session.mount("http://", HTTPAdapter(max_retries=retries))
-        session.mount("https://", HTTPAdapter(max_retries=retries))
+        # Downloads are retried by download_file, so the adapter does not
+        # retry them as well
+        FetchBase._mount_adapters(session, retries=Retry(total=0, read=False))
 
         # CASMCMS-6551 Disable session SSL Verification. In CASMCMS-6552 we need to
         # implement SSL verification once the RADOS GW implements a signed certificate.
         session.verify = False
-        session.hooks['response'].append(FetchBase.log_request)
-        session.hooks['response'].append(FetchBase.log_response)
+        FetchBase._add_logging_hooks(session)
 
         return session
 
+    @staticmethod
+    def _preallocate(fout, response):
+        """
+        Reserve disk space for a download whose size is known up front, so
+        large files are written to contiguous extents. Best effort only.
+        """
+        content_length = response.headers.get('Content-Length')
+        if not content_length or response.headers.get('Content-Encoding') \
+                or not hasattr(os, 'posix_fallocate'):
+            return
+        try:
+            os.posix_fallocate(fout.fileno(), 0, int(content_length))
+        except (OSError, ValueError) as err:
+            LOGGER.debug("Unable to preallocate %s bytes for %s: %s", content_length, fout.name, err)
+
+    def _download_stream(self, download_url, filename, digests=()):
+        """
+        Download a file as a single stream.
+
+        Args:
+            digests: names of hashlib algorithms to hash the file with as it
+                is downloaded
+        Returns:
+            dict of each digest name to the hex digest of the file
+        """
+        hashes = {name: hashlib.new(name) for name in digests}
+        with self.insecure_session.get(download_url, stream=True, allow_redirects=True,
+                                       timeout=DOWNLOAD_TIMEOUT) as response:
+            response.raise_for_status()
+            # Copy the body straight from the connection to the file
+            response.raw.decode_content = True
+            with open(filename, 'wb') as fout:
+                FetchBase._preallocate(fout, response)
+                if not hashes:
+                    shutil.copyfileobj(response.raw, fout, DOWNLOAD_CHUNK_SIZE)
+                else:
+                    for chunk in iter(lambda: response.raw.read(DOWNLOAD_CHUNK_SIZE), b""):
+                        for hash_obj in hashes.values():
+                            hash_obj.update(chunk)
+                        fout.write(chunk)
+                # Drop any preallocated space a short read left unused
+                fout.truncate(fout.tell())
+        return {name: hash_obj.hexdigest() for name, hash_obj in hashes.items()}
+
+    def _download_ranges(self, download_url, filename, digests=()):
+        """
+        Download a large file as concurrent byte ranges, each written at its
+        offset in the file, so the transfer is spread over several connections.
+        The file is hashed in order while the download runs: each range is read
+        back, while still in the page cache, once every range before it is done.
+
+        Args:
+            digests: names of hashlib algorithms to hash the file with
+        Returns:
+            dict of each digest name to the hex digest of the file, or None,
+            without downloading anything, when the server does not support
+            range requests or the file is too small to benefit.
+        """
+        # Probe with a one byte range GET rather than a HEAD, which presigned
+        # GET URLs do not allow; the response gives the size of the file.
+        with self.insecure_session.get(download_url, headers={'Range': 'bytes=0-0'}, stream=True,
+                                       allow_redirects=True, timeout=DOWNLOAD_TIMEOUT) as probe:
+            # Anything but a 206, including an error or the 416 an empty file
+            # gets, is left to the streamed download to handle or report
+            content_range = probe.headers.get('Content-Range', '')
+            if probe.status_code != 206 or probe.headers.get('Content-Encoding') \
+                    or not content_range.startswith('bytes ') or content_range.endswith('/*'):
+                return None
+            size = int(content_range.rsplit('/', 1)[1])
+            url = probe.url
+        if size < DOWNLOAD_RANGE_THRESHOLD:
+            return None
+
+        part_size = -(-size // DOWNLOAD_RANGE_WORKERS)
+        ranges = [(first, min(first + part_size, size) - 1) for first in range(0, size, part_size)]
+        LOGGER.info("Downloading %s bytes as %s concurrent ranges", size, len(ranges))
+        failed = threading.Event()
+        hashes = {name: hashlib.new(name) for name in digests}
+
+        def download_range(fd, first, last):
+            offset = first
+            with self.insecure_session.get(url, headers={'Range': f'bytes={first}-{last}'}, stream=True,
+                                           timeout=DOWNLOAD_TIMEOUT) as response:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise RequestException(
+                        f"Request for bytes {first}-{last} returned status {response.status_code}")
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    if failed.is_set():
+                        return
+                    os.pwrite(fd, chunk, offset)
+                    offset += len(chunk)
+            if offset != last + 1:
+                raise RequestException(
+                    f"Request for bytes {first}-{last} ended after {offset - first} bytes")
+
+        def hash_range(fd, first, last):
+            offset = first
+            while offset <= last:
+                chunk = os.pread(fd, min(DOWNLOAD_CHUNK_SIZE, last + 1 - offset), offset)
+                for hash_obj in hashes.values():
+                    hash_obj.update(chunk)
+                offset += len(chunk)
+
+        fd = os.open(filename, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o666)
+        try:
+            try:
+                os.posix_fallocate(fd, 0, size)
+            except (AttributeError, OSError):
+                os.ftruncate(fd, size)
+            with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+                futures = {executor.submit(download_range, fd, first, last): index
+                           for index, (first, last) in enumerate(ranges)}
+                completed = set()
+                next_to_hash = 0
+                try:
+                    for future in as_completed(futures):
+                        future.result()
+                        completed.add(futures[future])
+                        while hashes and next_to_hash in completed:
+                            hash_range(fd, *ranges[next_to_hash])
+                            next_to_hash += 1
+                except BaseException:
+                    failed.set()
+                    raise
+        finally:
+            os.close(fd)
+        return {name: hash_obj.hexdigest() for name, hash_obj in hashes.items()}
+
     def download_file(self, download_url, filename):
         """
         Download file using python requests session.
@@ -213,45 +435,86 @@ class FetchBase(object):
         # insure the parent dirs exist
         os.makedirs(os.path.dirname(filename), exist_ok=True)
 
+        # Expected checksums of the file, by hashlib algorithm name
+        expected_digests = {
+            name: value for name, value in (
+                ('md5', os.environ.get("DOWNLOAD_MD5SUM", "")),
+                ('sha256', os.environ.get("DOWNLOAD_SHA256SUM", "")),
+            ) if value
+        }
+
         # allow multiple failures while tring to download file
         LOGGER.info("Saving file as '%s'", filename)
-        numAttempts=0
-        sleepTime=10
-        maxAttempts=20
-        while numAttempts<maxAttempts:
+        calculated_digests = {}
+        downloaded = False
+        numAttempts = 0
+        while numAttempts < DOWNLOAD_ATTEMPTS:
+            numAttempts += 1
             try:
-                response = self.insecure_session.get(download_url, stream=True, allow_redirects=True)
-                response.raise_for_status()
-                if response.ok:
-                    with open(filename, 'wb') as fout:
-                        for chunk in response.iter_content(chunk_size=1024*1024):
-                            if chunk:
-                                fout.write(chunk)
+                calculated_digests = self._download_ranges(download_url, filename, expected_digests)
+                if calculated_digests is None:
+                    calculated_digests = self._download_stream(download_url, filename, expected_digests)
                 LOGGER.info("File download complete.")
+                downloaded = True
                 break
-            except RequestException as err:
+            except (RequestException, Urllib3HTTPError) as err:
                 # catch the exception so we can try again
                 LOGGER.warning(f"Error {err} downloading {download_url}")
+                if not FetchBase._download_error_is_retryable(err):
+                    break
 
-            numAttempts += 1
-            LOGGER.warning(f"Sleeping {sleepTime} sec and trying again...")
-            time.sleep(sleepTime)
+            if numAttempts < DOWNLOAD_ATTEMPTS:
+                sleepTime = min(DOWNLOAD_MAX_BACKOFF, 2 ** numAttempts + random.random())
+                LOGGER.warning(f"Sleeping {sleepTime:.1f} sec and trying again...")
+                time.sleep(sleepTime)
 
-        # if we have hit number of attempts without succeeding bail
-        if numAttempts >= maxAttempts:
+        # bail if the download never succeeded
+        if not downloaded:
             LOGGER.error(f"Failed to download {download_url} after {numAttempts} tries.")
-            self.ims_helper.image_set_job_status(self.IMS_JOB_ID, "error")
+            self.set_job_status("error")
             sys.exit(1)
 
-        # verify the md5 sum of the downloaded file
-        download_md5sum = os.environ.get("DOWNLOAD_MD5SUM", "")
-        if download_md5sum:
-            LOGGER.info("Verifying md5sum of the downloaded file.")
-            if download_md5sum != ImsHelper._md5(filename):
-                LOGGER.error("The calculated md5sum does not match the expected value.")
-                self.ims_helper.image_set_job_status(self.IMS_JOB_ID, "error")
+        # verify the checksums of the downloaded file, which were calculated
+        # during the download
+        for name, expected in expected_digests.items():
+            LOGGER.info("Verifying %s of the downloaded file.", name)
+            if expected.lower() != calculated_digests[name]:
+                LOGGER.error("The calculated %s does not match the expected value.", name)
+                self.set_job_status("error")
                 sys.exit(1)
-            LOGGER.info("Successfully verified the md5sum of the downloaded file.")
+            LOGGER.info("Successfully verified the %s of the downloaded file.", name)
+
+    @staticmethod
+    def _download_error_is_retryable(err):
+        """
+        Return whether downloading again could fix err; client errors such as
+        403 or 404 will not go away by retrying.
+        """
+        response = getattr(err, 'response', None)
+        if isinstance(err, requests.exceptions.HTTPError) and response is not None:
+            status = response.status_code
+            return not 400 <= status < 500 or status in DOWNLOAD_RETRYABLE_CLIENT_ERRORS
+        return True
+
+    def set_job_status(self, job_status, wait=True):
+        """
+        Set the status of the IMS job. With wait=False the update is sent in
+        the background, so the fetch can continue without waiting on IMS;
+        updates are still sent in order, and a later update made with
+        wait=True first waits for all earlier ones.
+        """
+        future = self._status_executor.submit(
+            self.ims_helper.image_set_job_status, self.IMS_JOB_ID, job_status)
+        if wait:
+            future.result()
+        else:
+            future.add_done_callback(self._log_status_error)
+
+    @staticmethod
+    def _log_status_error(future):
+        exc = future.exception()
+        if exc is not None:
+            LOGGER.warning("Error setting job status in the background.", exc_info=exc)
 
     def run(self):
         pass
@@ -268,31 +531,33 @@ class FetchImage(FetchBase):
 
     def delete_signal_files(self):
         """ The signal files should not exist. If they do, remove them. """
-        for signal_file in ("ready", "complete", "exiting"):
+        for signal_file in SIGNAL_FILES:
             try:
-                fn = os.path.join(self.path, signal_file)
-                if os.path.isfile(fn):
-                    os.remove(fn)
+                os.unlink(os.path.join(self.path, signal_file))
+            except FileNotFoundError:
+                pass
             except OSError as exc:
                 LOGGER.error("Error while trying to remove signal file %s.", signal_file, exc_info=exc)
-                self.ims_helper.image_set_job_status(self.IMS_JOB_ID, "error")
+                self.set_job_status("error")
                 sys.exit(1)
 
     def unsquash_image(self):
         # Expand the image root from its archive (squashfs) and remove the archive
         try:
-            subprocess.check_output(["unsquashfs", "-f", "-d",
-                                     "{}".format(os.path.join(self.path, "image-root")),
-                                     self.image_sqshfs])
+            subprocess.check_call(["unsquashfs", "-f", "-no-progress",
+                                   "-processors", str(os.cpu_count() or 4), "-d",
+                                   os.path.join(self.path, "image-root"),
+                                   self.image_sqshfs],
+                                  stdout=subprocess.DEVNULL)
         except subprocess.CalledProcessError as exc:
             LOGGER.error("Error unsquashing image root.", exc_info=exc)
-            self.ims_helper.image_set_job_status(self.IMS_JOB_ID, "error")
+            self.set_job_status("error")
             sys.exit(1)
 
     def run(self, unpack: bool = True):
         try:
             LOGGER.info("Setting job status to 'fetching_image'.")
-            self.ims_helper.image_set_job_status(self.IMS_JOB_ID, "fetching_image")
+            self.set_job_status("fetching_image", wait=False)
             if not os.path.exists(self.path):
                 os.makedirs(self.path)
             LOGGER.info("Fetching image %s", self.url)
@@ -306,12 +571,13 @@ class FetchImage(FetchBase):
                 LOGGER.info("Skipping image unsquash")
         except Exception as exc:
             LOGGER.error("Error unhandled exception while fetching image root.", exc_info=exc)
-            self.ims_helper.image_set_job_status(self.IMS_JOB_ID, "error")
+            self.set_job_status("error")
             sys.exit(1)
         finally:
             if os.path.isfile(self.image_sqshfs) and unpack:
                 LOGGER.info("Deleting compressed image %s", self.image_sqshfs)
                 os.remove(self.image_sqshfs)
+            self._status_executor.shutdown(wait=True)
             LOGGER.info("Done")
 
 
@@ -325,13 +591,25 @@ class FetchRecipe(FetchBase):
         self.recipe_tgz = os.path.join(self.path, "recipe.tgz")
 
     def untar_recipe(self):
-        # Expand the image root from its archive (squashfs) and remove the archive
+        # Expand the recipe from its archive (gzipped tar); decompress with pigz,
+        # which does its reads, writes and checksums on separate threads, when
+        # it is installed
         try:
-            tar = tarfile.open(self.recipe_tgz)
-            tar.extractall(path=self.path)
-        except subprocess.CalledProcessError as exc:
-            LOGGER.error("Error unsquashing image root.", exc_info=exc)
-            self.ims_helper.image_set_job_status(self.IMS_JOB_ID, "error")
+            if shutil.which("pigz"):
+                subprocess.check_call(["tar", "--use-compress-program=pigz", "-xf", self.recipe_tgz,
+                                       "-C", self.path])
+            else:
+                with open(self.recipe_tgz, 'rb') as tgz:
+                    if hasattr(os, 'posix_fadvise'):
+                        os.posix_fadvise(tgz.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                    # Stream the archive front to back rather than seeking around in it
+                    with tarfile.open(fileobj=tgz, mode='r|gz', bufsize=1024 * 1024) as tar:
+                        # Extract with the same safety rules as the tar command above
+                        extract_kwargs = {'filter': 'tar'} if hasattr(tarfile, 'tar_filter') else {}
+                        tar.extractall(path=self.path, **extract_kwargs)
+        except (subprocess.CalledProcessError, tarfile.TarError) as exc:
+            LOGGER.error("Error uncompressing recipe.", exc_info=exc)
+            self.set_job_status("error")
             sys.exit(1)
 
     def template_recipe(self):
@@ -343,10 +621,10 @@ class FetchRecipe(FetchBase):
         # Compile a list of key/value pairs from the environment
         template_values = {}
         try:
-            with open("/etc/cray/template_dictionary") as inf:
-                template_values = yaml.safe_load(inf)
+            template_values = _load_template_dictionary(
+                TEMPLATE_DICTIONARY, os.stat(TEMPLATE_DICTIONARY).st_mtime_ns)
         except FileNotFoundError:
-            LOGGER.warning("/etc/cray/template_dictionary was not found. Will continue without templating the recipe.")
+            LOGGER.warning(f"{TEMPLATE_DICTIONARY} was not found. Will continue without templating the recipe.")
             return
 
         if not os.path.isfile(ims_recipe_template_yaml) and not template_values:
@@ -365,38 +643,51 @@ class FetchRecipe(FetchBase):
 
         with open(ims_recipe_template_yaml) as inf_yaml:
             try:
+                # One environment renders every file; the recipe does not change
+                # while it is templated, so there is no need to check templates
+                # for changes
                 loader = jinja2.FileSystemLoader(self.path)
-                env = jinja2.Environment(loader=loader)
+                env = jinja2.Environment(loader=loader, auto_reload=False)
 
-                ims_recipe_template = yaml.safe_load(inf_yaml)
+                ims_recipe_template = yaml.load(inf_yaml, Loader=YAML_SAFE_LOADER)
+                recipe_dir = pathlib.Path(self.path).resolve()
                 for template_file in ims_recipe_template['template_files']:
 
-                    # Make sure that we're looking at a file within the recipe directory
-                    absolute_file_name = os.path.abspath(
-                        os.path.expanduser(os.path.join(self.path, template_file))
-                    )
-
-                    if not absolute_file_name.startswith(self.path):
+                    # Make sure that we're looking at a file within the recipe directory,
+                    # following any symbolic links
+                    absolute_file_name = (recipe_dir / template_file).resolve()
+                    try:
+                        relative_file_name = absolute_file_name.relative_to(recipe_dir)
+                    except ValueError:
                         LOGGER.error(
                             f"The recipe is trying to template a file '{absolute_file_name}' "
                             "outside of the IMS recipe directory.")
                         sys.exit(1)
 
                     # Check that the file exists
-                    if not os.path.isfile(absolute_file_name):
+                    if not absolute_file_name.is_file():
                         LOGGER.error(
                             f"The recipe is trying to template a file '{absolute_file_name}' that does not exist.")
                         sys.exit(1)
 
                     # Apply the template modifications
-                    template = env.get_template(absolute_file_name[len(self.path) + 1:])
-                    with tempfile.NamedTemporaryFile("w", delete=False) as outf:
-                        outf.write(template.render(**template_values))
-
-                    # remove the original file replace with the templated version - preserve the permissions
-                    shutil.copymode(absolute_file_name, outf.name)
-                    os.remove(absolute_file_name)
-                    shutil.move(outf.name, absolute_file_name)
+                    template = env.get_template(relative_file_name.as_posix())
+                    # Render next to the original so it can be renamed over it
+                    outf = tempfile.NamedTemporaryFile("w", delete=False, dir=absolute_file_name.parent)
+                    try:
+                        with outf:
+                            outf.write(template.render(**template_values))
+
+                        # replace the original file with the templated version - preserve the permissions
+                        shutil.copymode(absolute_file_name, outf.name)
+                        os.replace(outf.name, absolute_file_name)
+                    except BaseException:
+                        # Do not leave a stray temporary file in the recipe
+                        try:
+                            os.unlink(outf.name)
+                        except FileNotFoundError:
+                            pass
+                        raise
             except KeyError as keyerror:
                 LOGGER.error("Error: Missing key while reading .ims_recipe_template.yaml file.", exc_info=keyerror)
 
@@ -406,7 +697,7 @@ class FetchRecipe(FetchBase):
     def run(self):
         try:
             LOGGER.info("Setting job status to 'fetching_recipe'.")
-            self.ims_helper.image_set_job_status(self.IMS_JOB_ID, "fetching_recipe")
+            self.set_job_status("fetching_recipe", wait=False)
             LOGGER.info("Fetching recipe %s", self.url)
             self.download_file(self.url, self.recipe_tgz)
             LOGGER.info("Uncompressing recipe into %s", self.path)
@@ -415,10 +706,11 @@ class FetchRecipe(FetchBase):
             self.template_recipe()
         except Exception as exc:
             LOGGER.error("Error unhandled exception while fetching recipe.", exc_info=exc)
-            self.ims_helper.image_set_job_status(self.IMS_JOB_ID, "error")
+            self.set_job_status("error")
             sys.exit(1)
         finally:
             if os.path.isfile(self.recipe_tgz):
                 LOGGER.info("Deleting compressed recipe %s", self.recipe_tgz)
                 os.remove(self.recipe_tgz)
+            self._status_executor.shutdown(wait=True)
             LOGGER.info("Done")
@@ -1,7 +1,7 @@
 #
 # MIT License
 #
-# (C) Copyright 2023 Hewlett Packard Enterprise Development LP
+# (C) Copyright 2023, 2026 Hewlett Packard Enterprise Development LP
 #
 # Permission is hereby granted, free of charge, to any person obtaining a
 # copy of this software and associated documentation files (the "Software"),
@@ -24,17 +24,42 @@
 
 import logging
 import os
+import random
+import stat
 import sys
 import time
+from functools import lru_cache
 import oauthlib.oauth2
 import requests
 import requests_oauthlib
-from oauthlib.oauth2.rfc6749.errors import OAuth2Error  # noqa: E402
+from oauthlib.oauth2.rfc6749.errors import (  # noqa: E402
+    InvalidClientError, InvalidRequestError, InvalidScopeError, OAuth2Error, UnauthorizedClientError
+)
+from requests.adapters import HTTPAdapter
+
+from ims_python_helper import JitteredRetry
+
+# Size of the connection pool kept per host by sessions, so repeated calls to
+# the same service reuse established (TLS) connections
+SESSION_POOL_CONNECTIONS = 32
+
+# Token requests are retried with exponential backoff and jitter, up to this
+# many attempts, before giving up
+TOKEN_FETCH_ATTEMPTS = 10
+TOKEN_FETCH_MAX_BACKOFF = 64
+
+# Token errors caused by the client configuration; retrying cannot fix them
+TOKEN_FETCH_PERMANENT_ERRORS = (
+    InvalidClientError, InvalidRequestError, InvalidScopeError, UnauthorizedClientError
+)
 
 def create_oauth_session(oauth_client_id, oauth_client_secret, ssl_cert, 
-                         token_url, timeout, logger=None):  # noqa: E501
+                         token_url, timeout, logger=None,
+                         pool_connections=SESSION_POOL_CONNECTIONS):  # noqa: E501
     """
-    Create a session for this client when connecting with Shasta services
+    Create a session for this client when connecting with Shasta services.
+    The session keeps up to pool_connections connections open per host;
+    callers that make more concurrent requests than that can raise it.
     """
     if not all([oauth_client_id, oauth_client_secret, token_url]):
         raise ValueError(
@@ -58,38 +83,69 @@ def create_oauth_session(oauth_client_id, oauth_client_secret, ssl_cert,
     session.verify = ssl_cert
     session.timeout = timeout
 
-    hookLogger = RequestLogger(logger)
-    session.hooks['response'].append(hookLogger.log_request)
-    session.hooks['response'].append(hookLogger.log_response)
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_connections,
+        max_retries=JitteredRetry(total=5, backoff_factor=0.2, status_forcelist=[502, 503, 504])
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    # Only hook in request logging when it would log anything
+    if logger is not None and logger.isEnabledFor(logging.DEBUG):
+        hookLogger = RequestLogger(logger)
+        session.hooks['response'].append(hookLogger.log_request)
+        session.hooks['response'].append(hookLogger.log_response)
+
+    # Later token expiry is handled by the session itself through
+    # auto_refresh_url; only the initial token is fetched here.
+    _acquire_initial_token(session, token_url, oauth_client_id, oauth_client_secret, logger)
+    return session
+
 
+def _acquire_initial_token(session, token_url, oauth_client_id, oauth_client_secret, logger=None):
+    """
+    Fetch the first token for an OAuth session, retrying with exponential
+    backoff and jitter. Raises the last error once all attempts fail, or
+    right away for errors that retrying cannot fix, such as an invalid client.
+    """
     token = None
-    attempt_timeout = 0
-    sleep_ceiling = 64
-    while True:
+    last_error = None
+    for attempt in range(TOKEN_FETCH_ATTEMPTS):
         try:
             token = session.fetch_token(
                 token_url=token_url, client_id=oauth_client_id,
                 client_secret=oauth_client_secret, timeout=500)
-        except OAuth2Error as oa2e:
+        except TOKEN_FETCH_PERMANENT_ERRORS as err:
+            if logger is not None:
+                logger.error("fetch_token failed, not retrying: %s", err)
+            raise
+        except (OAuth2Error, requests.exceptions.RequestException) as err:
             # In practice, this can fail for a very large number of reasons
-            # from the underlying oauth lib. Rather than special casing each
-            # and every one, we simply verify that a token was successfully
+            # from the underlying oauth lib, or from the connection to the auth
+            # service itself (e.g. DNS failures). Rather than special casing
+            # each and every one, we simply verify that a token was successfully
             # generated and then log the raising exception. We otherwise do not
             # want to get into the business of special casing the kinds of
             # failures that the oauthlib2 library can raise.
-            if logger != None:
-                logger.warning(oa2e)
-        if not token:
-            time.sleep(attempt_timeout)
-            if attempt_timeout != sleep_ceiling:
-                attempt_timeout += 1
-            if logger != None:
-                logger.info(
-                    "Unable to obtain token from auth service, retrying in %s seconds", attempt_timeout
-            )
-        else:
+            last_error = err
+            if logger is not None:
+                logger.warning("fetch_token failed: %s", err)
+        if token:
+            return token
+        if attempt == TOKEN_FETCH_ATTEMPTS - 1:
             break
-    return session
+        delay = random.uniform(0, min(TOKEN_FETCH_MAX_BACKOFF, 2 ** attempt))
+        if logger is not None:
+            logger.info(
+                "Unable to obtain token from auth service, retrying in %.1f seconds", delay
+            )
+        time.sleep(delay)
+
+    if last_error is not None:
+        raise last_error
+    raise OAuth2Error(description="Unable to obtain token from auth service after %s attempts"
+                      % TOKEN_FETCH_ATTEMPTS)
 
 def get_admin_client_auth(logger=None):
     """
@@ -102,32 +158,43 @@ def get_admin_client_auth(logger=None):
     default_oauth_endpoint = ""
 
     oauth_config_dir = os.environ.get("OAUTH_CONFIG_DIR", "/etc/admin-client-auth")
-    if os.path.isdir(oauth_config_dir):
-        oauth_client_id_path = os.path.join(oauth_config_dir, 'client-id')
-        if os.path.exists(oauth_client_id_path):
-            with open(oauth_client_id_path) as auth_client_id_f:
-                default_oauth_client_id = auth_client_id_f.read().strip()
-        oauth_client_secret_path = os.path.join(oauth_config_dir, 'client-secret')
-        if os.path.exists(oauth_client_secret_path):
-            with open(oauth_client_secret_path) as oauth_client_secret_f:
-                default_oauth_client_secret = oauth_client_secret_f.read().strip()
-        oauth_endpoint_path = os.path.join(oauth_config_dir, 'endpoint')
-        if os.path.exists(oauth_endpoint_path):
-            with open(oauth_endpoint_path) as oauth_endpoint_f:
-                default_oauth_endpoint = oauth_endpoint_f.read().strip()
+    try:
+        config_dir_stat = os.stat(oauth_config_dir)
+    except OSError:
+        config_dir_stat = None
+    if config_dir_stat is not None and stat.S_ISDIR(config_dir_stat.st_mode):
+        default_oauth_client_id, default_oauth_client_secret, default_oauth_endpoint = \
+            _read_admin_client_auth_files(oauth_config_dir, config_dir_stat.st_mtime_ns)
 
     oauth_client_id = os.environ.get("OAUTH_CLIENT_ID", default_oauth_client_id)
     oauth_client_secret = os.environ.get("OAUTH_CLIENT_SECRET", default_oauth_client_secret)
     oauth_client_endpoint = os.environ.get("OAUTH_CLIENT_ENDPOINT", default_oauth_endpoint)
 
     if not all([oauth_client_id, oauth_client_secret, oauth_client_endpoint]):
-        if logger != None:
+        if logger is not None:
             logger.error("Invalid oauth configuration. Determine the specific information that "
                      "is missing or invalid and then re-run the request with valid information.")
         sys.exit(1)
 
     return oauth_client_id, oauth_client_secret, oauth_client_endpoint
 
+@lru_cache(maxsize=1)
+def _read_admin_client_auth_files(oauth_config_dir, mtime):  # pylint: disable=unused-argument
+    """
+    Read the OAuth client ID, client secret and endpoint from oauth_config_dir,
+    defaulting each missing file to "". The result is cached; mtime is only
+    part of the cache key, so the files are read again once the directory
+    changes (e.g. when a mounted secret is updated).
+    """
+    values = []
+    for name in ('client-id', 'client-secret', 'endpoint'):
+        try:
+            with open(os.path.join(oauth_config_dir, name), encoding="utf-8") as inf:
+                values.append(inf.read().strip())
+        except FileNotFoundError:
+            values.append("")
+    return tuple(values)
+
 class RequestLogger(object):
     """
     Helper class to wrap an external logger with funtions that can be
@@ -144,24 +211,25 @@ class RequestLogger(object):
         Args:
             resp : The response
         """
-        if self.LOGGER != None and self.LOGGER.isEnabledFor(logging.DEBUG):
+        if self.LOGGER is not None and self.LOGGER.isEnabledFor(logging.DEBUG):
             self.LOGGER.debug('\n%s\n%s\n%s\n\n%s',
                         '-----------START REQUEST-----------',
                         resp.request.method + ' ' + resp.request.url,
-                        '\n'.join('{}: {}'.format(k, v) for k, v in list(resp.request.headers.items())),
+                        '\n'.join(f'{k}: {v}' for k, v in resp.request.headers.items()),
                         resp.request.body)
 
 
     def log_response(self, resp, *args, **kwargs):
         """
-        This function logs the response.
+        This function logs the response. The body of a streamed response is
+        not logged, since reading it here would load all of it into memory.
 
         Args:
             resp : The response
         """
-        if self.LOGGER !=None and self.LOGGER.isEnabledFor(logging.DEBUG):
+        if self.LOGGER is not None and self.LOGGER.isEnabledFor(logging.DEBUG):
             self.LOGGER.debug('\n%s\n%s\n%s\n\n%s',
                         '-----------START RESPONSE----------',
                         resp.status_code,
-                        '\n'.join('{}: {}'.format(k, v) for k, v in list(resp.headers.items())),
-                        resp.content)
\ No newline at end of file
+                        '\n'.join(f'{k}: {v}' for k, v in resp.headers.items()),
+                        '<streamed>' if kwargs.get('stream') else resp.content)
\ No newline at end of file
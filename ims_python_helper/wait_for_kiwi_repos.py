@@ -1,7 +1,7 @@
 #
 # MIT License
 #
-# (C) Copyright 2023 Hewlett Packard Enterprise Development LP
+# (C) Copyright 2023, 2026 Hewlett Packard Enterprise Development LP
 #
 # Permission is hereby granted, free of charge, to any person obtaining a
 # copy of this software and associated documentation files (the "Software"),
@@ -24,16 +24,36 @@
 
 import logging
 import os
+import re
 import sys
 import time
 import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
 import requests
+from requests.adapters import HTTPAdapter
 
 from ims_python_helper import ImsHelper
 from ims_python_helper.session import create_oauth_session, get_admin_client_auth
 
 IMS_JOB_STATUS = "waiting_for_repos"
 
+# Seconds to wait, once the repos are available, for the background job
+# status update to finish
+STATUS_UPDATE_TIMEOUT = 5
+
+# Most repos probed at the same time in each polling cycle
+MAX_CONCURRENT_PROBES = 8
+
+# Repos are usually not ready yet on the first polling cycles, so those use
+# short probe timeouts and sleeps; both double each cycle up to their maximum
+PROBE_TIMEOUT_INITIAL = 2
+PROBE_TIMEOUT_MAX = 10
+POLL_INTERVAL_INITIAL = 5
+POLL_INTERVAL_MAX = 30
+
+# Only http(s) repos can be probed; URL schemes are case-insensitive
+REPO_URL_RE = re.compile(r'https?://', re.IGNORECASE)
+
 def wait_for_kiwi_repos(ims_job_id: str, ims_url: str, ca_cert:str,
                         recipe_root: str, timeout: int,
                         logger: logging.Logger) -> int:
@@ -52,33 +72,69 @@ def wait_for_kiwi_repos(ims_job_id: str, ims_url: str, ca_cert:str,
     """
     # if the user provides a logger, use it
     myLogger = logging.getLogger()
-    if logger != None:
+    if logger is not None:
         myLogger = logger
 
-    # create an oauth session
-    oauth_client_id, oauth_client_secret, oauth_client_endpoint = get_admin_client_auth(myLogger)
-    session = create_oauth_session(oauth_client_id, oauth_client_secret, ca_cert, oauth_client_endpoint, myLogger)
+    # set ims job status to 'waiting for repos'; only this needs an oauth session
+    def set_waiting_for_repos(oauth_client_id, oauth_client_secret, oauth_client_endpoint):
+        session = create_oauth_session(oauth_client_id, oauth_client_secret, ca_cert, oauth_client_endpoint,
+                                       timeout, logger=myLogger)
+        ims_helper = ImsHelper(
+            ims_url=ims_url,
+            session=session,
+            s3_host=os.environ.get('S3_HOST', None),
+            s3_secret_key=os.environ.get('S3_SECRET_KEY', None),
+            s3_access_key=os.environ.get('S3_ACCESS_KEY', None),
+            s3_bucket=os.environ.get('S3_BUCKET', None)
+        )
+        _set_ims_job_status(ims_helper, ims_job_id, myLogger)
+
+    # The status is set in the background, so probing the repos does not
+    # wait on the auth service and IMS
+    status_update = None
+    status_executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        if ims_job_id:
+            status_update = status_executor.submit(set_waiting_for_repos, *get_admin_client_auth(myLogger))
+
+        # check repo availability; repos are not behind the API gateway, so they
+        # are probed without the oauth token
+        retVal = _wait_for_kiwi_ng_repos(recipe_root, _create_probe_session(ca_cert), myLogger, timeout)
+    finally:
+        status_executor.shutdown(wait=False)
+
+    # The status is informational; a slow or failed update must not hold up
+    # or override the result of the repo wait
+    if status_update is not None:
+        try:
+            status_update.result(timeout=STATUS_UPDATE_TIMEOUT)
+        except FutureTimeoutError:
+            myLogger.warning("Job status update did not finish within %s seconds", STATUS_UPDATE_TIMEOUT)
+        except Exception as exc:  # pylint: disable=broad-except
+            myLogger.warning("Error setting job status: %s", exc)
+    return retVal
 
-    # set ims job status to 'waiting for repos'
-    _set_ims_job_status(ims_job_id, ims_url, session, myLogger)
 
-    # check repo availability
-    return _wait_for_kiwi_ng_repos(recipe_root, session, myLogger, timeout)
+def _create_probe_session(ca_cert) -> requests.Session:
+    """
+    Create a plain session for probing repos, with a connection pool large
+    enough for all concurrent probes. The adapter does not retry; the
+    polling loop already probes again on the next cycle.
+    """
+    session = requests.Session()
+    session.verify = ca_cert
+    adapter = HTTPAdapter(pool_connections=MAX_CONCURRENT_PROBES, pool_maxsize=MAX_CONCURRENT_PROBES)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
 
 
-def _set_ims_job_status(ims_job_id: str, ims_url: str, session, logger: logging.Logger) -> None:
+def _set_ims_job_status(ims_helper: ImsHelper, ims_job_id: str, logger: logging.Logger,
+                        job_status: str = IMS_JOB_STATUS) -> None:
     try:
-        if ims_job_id:
-            logger.info("Setting job status to '%s'", IMS_JOB_STATUS)
-            result = ImsHelper(
-                ims_url=ims_url,
-                session=session,
-                s3_host=os.environ.get('S3_HOST', None),
-                s3_secret_key=os.environ.get('S3_SECRET_KEY', None),
-                s3_access_key=os.environ.get('S3_ACCESS_KEY', None),
-                s3_bucket=os.environ.get('S3_BUCKET', None)
-            )._ims_job_patch_job_status(ims_job_id, IMS_JOB_STATUS)
-            logger.info("Result of setting job status: %s", result)
+        logger.info("Setting job status to '%s'", job_status)
+        result = ims_helper._ims_job_patch_job_status(ims_job_id, job_status)
+        logger.info("Result of setting job status: %s", result)
     except requests.exceptions.HTTPError as exc:
         logger.warning("Error setting job status %s" % exc)
 
@@ -93,10 +149,7 @@ def _wait_for_kiwi_ng_repos(recipe_root, session, logger: logging.Logger, timeou
     retVal = 0
     try:
         # introspect the recipe and look for any defined repos
-        root = ET.parse(config_xml_file).getroot()
-        repos = [type_tag.get('path') for type_tag in root.findall('repository/source')
-                 if type_tag is not None and type_tag.get('path') and
-                 type_tag.get('path').lower().startswith(('http://', 'https://'))]
+        repos = _find_repo_urls(config_xml_file)
 
         retVal = _wait_for_repos(repos, session, logger, timeout)
     except ET.ParseError as xml_err:
@@ -105,32 +158,81 @@ def _wait_for_kiwi_ng_repos(recipe_root, session, logger: logging.Logger, timeou
     return retVal
 
 
+def _find_repo_urls(config_xml_file) -> list:
+    """
+    Return the http(s) paths of the repository/source elements in a kiwi-ng
+    config.xml, without duplicates. The file is parsed incrementally and each
+    element is cleared once read, so large package lists are never held in
+    memory.
+    """
+    repos = []
+    seen = set()
+    tags = []
+    for event, elem in ET.iterparse(config_xml_file, events=('start', 'end')):
+        if event == 'start':
+            tags.append(elem.tag)
+            continue
+        # repository/source, relative to the root element
+        if tags[1:] == ['repository', 'source']:
+            path = elem.get('path')
+            # Several sources can point at the same repo; probe it only once
+            if path and REPO_URL_RE.match(path) and path.rstrip('/') not in seen:
+                seen.add(path.rstrip('/'))
+                repos.append(path)
+        tags.pop()
+        elem.clear()
+    return repos
+
+
 def _wait_for_repos(repos: list, session, logger: logging.Logger, timeout: int)-> int:
     """ Wait for all the defined repos to become available. """
     if repos:
         logger.info("Recipe contains the following repos: %s" % repos)
+        # The repodata of each repo is probed to see if the repo is available
+        probe_urls = ["%s/repodata/repomd.xml" % repo.strip("/") for repo in repos]
         stTime = time.perf_counter()
         # Wait for all the defined repos to be available via HTTP/HTTPS
-        while not all([is_repo_available(session, repo, logger, 10) for repo in repos]):
-            if time.perf_counter() - stTime > timeout:
-                logger.info("Repos failed to be ready before timeout")
-                return 1
-            logger.info("Sleeping for 10 seconds")
-            time.sleep(10)
+        cycle = 0
+        with ThreadPoolExecutor(max_workers=min(len(repos), MAX_CONCURRENT_PROBES)) as executor:
+            while not _all_repos_available(executor, session, probe_urls, logger,
+                                           min(PROBE_TIMEOUT_MAX, PROBE_TIMEOUT_INITIAL * 2 ** cycle)):
+                if time.perf_counter() - stTime > timeout:
+                    logger.info("Repos failed to be ready before timeout")
+                    return 1
+                sleep_time = min(POLL_INTERVAL_MAX, POLL_INTERVAL_INITIAL * 2 ** cycle)
+                logger.info("Sleeping for %s seconds", sleep_time)
+                time.sleep(sleep_time)
+                cycle += 1
     else:
         logger.info("No matching http(s) repos found. Exiting.")
         return 1
     return 0
 
 
-def is_repo_available(session, repo_url, logger, timeout):
-    """ Try to determine if the repo is available by getting the repodata/repomd.xml file"""
+def _all_repos_available(executor, session, probe_urls: list, logger: logging.Logger,
+                         probe_timeout: float) -> bool:
+    """
+    Probe the repos concurrently, waiting up to probe_timeout seconds for each. Returns False as soon as any repo is not
+    available, without waiting for the other probes; those that have not
+    started yet are cancelled.
+    """
+    futures = [executor.submit(is_repo_available, session, probe_url, logger, probe_timeout)
+               for probe_url in probe_urls]
+    for future in as_completed(futures):
+        if not future.result():
+            for other in futures:
+                other.cancel()
+            return False
+    return True
+
+
+def is_repo_available(session, probe_url, logger, timeout):
+    """ Try to determine if a repo is available by getting its repodata/repomd.xml file at probe_url"""
     try:
-        repo_md_xml = "/".join(arg.strip("/") for arg in [repo_url, 'repodata', 'repomd.xml'])
-        logger.info("Attempting to get {}".format(repo_md_xml))
-        response = session.head(repo_md_xml, timeout=timeout)
+        logger.info("Attempting to get {}".format(probe_url))
+        response = session.head(probe_url, timeout=timeout)
         response.raise_for_status()
-        logger.info("{} response getting {}".format(response.status_code, repo_md_xml))
+        logger.info("{} response getting {}".format(response.status_code, probe_url))
         return True
     except requests.exceptions.RequestException as err:
         logger.warning(err)
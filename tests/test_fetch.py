@@ -0,0 +1,253 @@
+#
+# MIT License
+#
+# (C) Copyright 2026 Hewlett Packard Enterprise Development LP
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+# OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+#
+
+"""
+Unit tests for fetch.py
+"""
+
+import hashlib
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import responses
+
+# Add ims_python_helper to path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ims_python_helper import fetch
+from ims_python_helper.fetch import FetchBase, FetchRecipe
+
+DOWNLOAD_URL = 'http://rgw.local/boot-images/image.sqsh'
+
+# Large enough to be split over several ranges with the patched settings below,
+# and not a multiple of the range size so the last range is short
+SOURCE = bytes(range(256)) * 41 + b'tail'
+
+
+class TestDownloadFile(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        rmock = responses.RequestsMock(assert_all_requests_are_fired=False)
+        rmock.start()
+        self.addCleanup(rmock.stop)
+        self.addCleanup(rmock.reset)
+        self.rmock = rmock
+
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.filename = os.path.join(tmpdir.name, 'image.sqsh')
+
+        for name, value in (('DOWNLOAD_CHUNK_SIZE', 1000),
+                            ('DOWNLOAD_RANGE_THRESHOLD', 4096),
+                            ('DOWNLOAD_RANGE_WORKERS', 4)):
+            patcher = mock.patch.object(fetch, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.dict(os.environ)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        os.environ.pop('DOWNLOAD_MD5SUM', None)
+        os.environ.pop('DOWNLOAD_SHA256SUM', None)
+        patcher = mock.patch.object(fetch.time, 'sleep')
+        self.mock_sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # Skip __init__, which needs an IMS job and OAuth credentials
+        self.fetcher = FetchBase.__new__(FetchBase)
+        self.fetcher.insecure_session = FetchBase._new_session()
+        self.fetcher.set_job_status = mock.Mock()
+
+        # Byte ranges requested from the server, other than the probe
+        self.ranges = []
+
+    def serve_ranges(self, request, content_range_size=None, short_ranges=0):
+        """
+        Serve SOURCE, honouring the Range header. The first short_ranges
+        ranges after the probe are cut short by one byte.
+        """
+        range_header = request.headers.get('Range')
+        if range_header is None:
+            return 200, {}, SOURCE
+        first, last = (int(value) for value in range_header[len('bytes='):].split('-'))
+        body = SOURCE[first:last + 1]
+        if range_header != 'bytes=0-0':
+            self.ranges.append((first, last))
+            if len(self.ranges) <= short_ranges:
+                body = body[:-1]
+        size = len(SOURCE) if content_range_size is None else content_range_size
+        return 206, {'Content-Range': f'bytes {first}-{last}/{size}'}, body
+
+    def add_callback(self, callback):
+        self.rmock.add_callback(responses.GET, DOWNLOAD_URL, callback=callback)
+
+    def read_download(self):
+        with open(self.filename, 'rb') as inf:
+            return inf.read()
+
+    def test_download_ranges(self):
+        """ Test that a file served as 206 ranges is downloaded in parts, byte for byte """
+        self.add_callback(self.serve_ranges)
+        with mock.patch.object(self.fetcher, '_download_stream') as mock_stream:
+            self.fetcher.download_file(DOWNLOAD_URL, self.filename)
+
+        mock_stream.assert_not_called()
+        self.assertEqual(SOURCE, self.read_download())
+        self.assertEqual(4, len(self.ranges))
+        self.assertEqual((len(SOURCE) - 1), max(last for _first, last in self.ranges))
+
+    def test_download_falls_back_to_stream_without_ranges(self):
+        """ Test that a server that answers the probe with a 200 is streamed from """
+        self.add_callback(lambda request: (200, {}, SOURCE))
+        with mock.patch.object(self.fetcher, '_download_stream',
+                               wraps=self.fetcher._download_stream) as mock_stream:
+            self.fetcher.download_file(DOWNLOAD_URL, self.filename)
+
+        mock_stream.assert_called_once()
+        self.assertEqual(SOURCE, self.read_download())
+
+    def test_download_falls_back_to_stream_with_unknown_size(self):
+        """ Test that a Content-Range without a size falls back to streaming """
+        self.add_callback(lambda request: self.serve_ranges(request, content_range_size='*'))
+        with mock.patch.object(self.fetcher, '_download_stream',
+                               wraps=self.fetcher._download_stream) as mock_stream:
+            self.fetcher.download_file(DOWNLOAD_URL, self.filename)
+
+        mock_stream.assert_called_once()
+        self.assertEqual([], self.ranges)
+        self.assertEqual(SOURCE, self.read_download())
+
+    def test_download_retries_short_range(self):
+        """ Test that a range that ends early fails the attempt and the download is retried """
+        self.add_callback(lambda request: self.serve_ranges(request, short_ranges=1))
+        self.fetcher.download_file(DOWNLOAD_URL, self.filename)
+
+        self.mock_sleep.assert_called_once()
+        self.fetcher.set_job_status.assert_not_called()
+        self.assertEqual(SOURCE, self.read_download())
+
+    def test_download_small_file_as_stream(self):
+        """ Test that a file below DOWNLOAD_RANGE_THRESHOLD is downloaded as a single stream """
+        self.add_callback(self.serve_ranges)
+        with mock.patch.object(fetch, 'DOWNLOAD_RANGE_THRESHOLD', len(SOURCE) + 1), \
+                mock.patch.object(self.fetcher, '_download_stream',
+                                  wraps=self.fetcher._download_stream) as mock_stream:
+            self.fetcher.download_file(DOWNLOAD_URL, self.filename)
+
+        mock_stream.assert_called_once()
+        self.assertEqual([], self.ranges)
+        self.assertEqual(SOURCE, self.read_download())
+
+    def test_download_empty_file(self):
+        """ Test that an empty object, whose range probe gets a 416, is downloaded as a stream """
+        def serve_empty(request):
+            if 'Range' in request.headers:
+                return 416, {'Content-Range': 'bytes */0'}, b''
+            return 200, {}, b''
+        self.add_callback(serve_empty)
+        self.fetcher.download_file(DOWNLOAD_URL, self.filename)
+
+        self.fetcher.set_job_status.assert_not_called()
+        self.assertEqual(b'', self.read_download())
+
+    def download_paths(self):
+        """ Callbacks that serve SOURCE so it is downloaded as ranges, or as a stream """
+        return (('ranges', self.serve_ranges), ('stream', lambda request: (200, {}, SOURCE)))
+
+    def test_download_verifies_digests(self):
+        """ Test that the digests of a downloaded file are checked against the whole file """
+        os.environ['DOWNLOAD_MD5SUM'] = hashlib.md5(SOURCE).hexdigest()
+        os.environ['DOWNLOAD_SHA256SUM'] = hashlib.sha256(SOURCE).hexdigest().upper()
+        for path, callback in self.download_paths():
+            with self.subTest(path=path):
+                self.rmock.reset()
+                self.ranges = []
+                self.add_callback(callback)
+                self.fetcher.download_file(DOWNLOAD_URL, self.filename)
+
+                self.fetcher.set_job_status.assert_not_called()
+                self.assertEqual(path == 'ranges', bool(self.ranges))
+                self.assertEqual(SOURCE, self.read_download())
+
+    def test_download_digest_mismatch(self):
+        """ Test that a file whose digest does not match fails the job """
+        os.environ['DOWNLOAD_MD5SUM'] = hashlib.md5(SOURCE).hexdigest()
+        os.environ['DOWNLOAD_SHA256SUM'] = hashlib.sha256(SOURCE[:-1]).hexdigest()
+        for path, callback in self.download_paths():
+            with self.subTest(path=path):
+                self.rmock.reset()
+                self.fetcher.set_job_status.reset_mock()
+                self.add_callback(callback)
+                self.assertRaises(SystemExit, self.fetcher.download_file, DOWNLOAD_URL, self.filename)
+
+                self.fetcher.set_job_status.assert_called_once_with("error")
+
+
+class TestTemplateRecipe(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.recipe_dir = os.path.join(tmpdir.name, 'recipe')
+        os.mkdir(self.recipe_dir)
+
+        template_dictionary = os.path.join(tmpdir.name, 'template_dictionary')
+        with open(template_dictionary, 'w') as outf:
+            outf.write('CSM_VERSION: 1.0.0\n')
+        patcher = mock.patch.object(fetch, 'TEMPLATE_DICTIONARY', template_dictionary)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        with open(os.path.join(self.recipe_dir, '.ims_recipe_template.yaml'), 'w') as outf:
+            outf.write('template_files:\n- config.xml\n')
+
+        # Skip __init__, which needs an IMS job and OAuth credentials
+        self.fetcher = FetchRecipe.__new__(FetchRecipe)
+        self.fetcher.path = self.recipe_dir
+
+    def write_template(self, content):
+        with open(os.path.join(self.recipe_dir, 'config.xml'), 'w') as outf:
+            outf.write(content)
+
+    def test_template_recipe(self):
+        """ Test that template files are rendered in place """
+        self.write_template('version {{ CSM_VERSION }}\n')
+        self.fetcher.template_recipe()
+
+        with open(os.path.join(self.recipe_dir, 'config.xml')) as inf:
+            self.assertEqual('version 1.0.0', inf.read())
+
+    def test_template_recipe_error_leaves_no_temporary_file(self):
+        """ Test that a template that fails to render leaves the recipe directory as it was """
+        self.write_template('version {{ 1 / 0 }}\n')
+        self.assertRaises(ZeroDivisionError, self.fetcher.template_recipe)
+
+        self.assertEqual(['.ims_recipe_template.yaml', 'config.xml'], sorted(os.listdir(self.recipe_dir)))
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -1,7 +1,7 @@
 #
 # MIT License
 #
-# (C) Copyright 2018-2019, 2021-2023 Hewlett Packard Enterprise Development LP
+# (C) Copyright 2018-2019, 2021-2023, 2026 Hewlett Packard Enterprise Development LP
 #
 # Permission is hereby granted, free of charge, to any person obtaining a
 # copy of this software and associated documentation files (the "Software"),
@@ -26,190 +26,212 @@
 Unit tests for resources/images.py
 """
 
+import hashlib
+import io
 import json
 import os
 import sys
+import tempfile
 import unittest
 import uuid
+from unittest import mock
 from unittest.mock import patch
 
 import botocore.exceptions
-import mock
 import requests
 import responses
 
 # Add ims_python_helper to path
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 
-from ims_python_helper import ImsHelper, ImsImagesExistWithName
-from testtools import TestCase
+from ims_python_helper import ImsHelper, ImsImagesExistWithName, \
+    BOOT_PARAMS_ARTIFACT_TYPE, INITRD_ARTIFACT_TYPE, KERNEL_ARTIFACT_TYPE, SQUASHFS_ARTIFACT_TYPE
 
 UPLOAD_TIMEOUT = 500
 
+_RMOCK = responses.RequestsMock(assert_all_requests_are_fired=False)
 
-class BaseTestImage(TestCase):
 
-    def setUp(self):
-        super().setUp()
+def setUpModule():
+    """ Patch requests once for the whole module rather than once per test """
+    _RMOCK.start()
 
-        self.test_domain = 'https://api-gw-service-nmn.local'
-        self.ims_url = '{}/apis/ims'.format(self.test_domain)
-        self.session = requests.session()
 
-        self.test_image_job_id = str(uuid.uuid4())
-        self.test_artifact_name = "test_image"
-        self.test_rootfs = ['/tmp/rootfs.sqsh']
-        self.test_kernel = ['/tmp/vmlinuz']
-        self.test_initrd = ['/tmp/initramfs']
-        self.test_debug = []
-        self.test_other = []
-        self.test_job_status = "waiting_on_user"
-
-        self.existing_ims_images = [
+def tearDownModule():
+    _RMOCK.stop()
+    _RMOCK.reset()
+
+
+class BaseTestImage(unittest.TestCase):
+    test_domain = 'https://api-gw-service-nmn.local'
+    ims_url = '{}/apis/ims'.format(test_domain)
+    images_url = '{}/images'.format(ims_url)
+    jobs_url = '{}/jobs'.format(ims_url)
+    recipes_url = '{}/recipes'.format(ims_url)
+
+    # Fixture data shared by the tests; none of them modify it
+    test_artifact_name = "test_image"
+    test_rootfs = ['/tmp/rootfs.sqsh']
+    test_kernel = ['/tmp/vmlinuz']
+    test_initrd = ['/tmp/initramfs']
+    test_debug = []
+    test_other = []
+    test_job_status = "waiting_on_user"
+
+    existing_ims_images = [
+        {
+            "created": "2022-01-01T00:00:00.00000+00:00",
+            "id": "f6c13ec7-89d1-4420-8f1d-1736b2d235cb",
+            "link": {
+                "etag": "d3b07384d113edec49eaa6238ad5ff00",
+                "path": "s3://boot-images/f6c13ec7-89d1-4420-8f1d-1736b2d235cb/manifest.json",
+                "type": "s3"
+            },
+            "name": "image_that_has_been_uploaded"
+        },
+        {
+            "created": "2022-01-01T00:00:00.00000+00:00",
+            "id": "d8a34ae4-ff5d-4ff7-b625-27e89006a428",
+            "name": "image_created_but_not_uploaded"
+        },
+    ]
+    new_ims_image = {
+        "created": "2022-01-01T00:00:00.00000+00:00",
+        "id": "602f9848-835c-49c8-833c-0fd4bb5c526f",
+        "name": "newly_created_image"
+    }
+
+    rootfs = 'rootfs.squashfs'
+    kernel = 'vmlinuz'
+    initrd = 'barebones.initrd'
+
+    rootfs_md5 = "29f6a020e682ea8ef6f7728cc8e055a3"
+    kernel_md5 = "6fc418e57f3d86c9b66e522f74cc1909"
+    initrd_md5 = "42488bf5d1400e6f563a39aab66292a6"
+    debug_md5 = "213c06c51ed7df6f08e02866c7758cb8"
+    params_md5 = "88e292b9447efefa8460bb2b17d043c0"
+    manifest = {
+        "artifacts": [
             {
-                "created": "2022-01-01T00:00:00.00000+00:00",
-                "id": "f6c13ec7-89d1-4420-8f1d-1736b2d235cb",
                 "link": {
-                    "etag": "d3b07384d113edec49eaa6238ad5ff00",
-                    "path": "s3://boot-images/f6c13ec7-89d1-4420-8f1d-1736b2d235cb/manifest.json",
+                    "etag": rootfs_md5,
+                    "path": "s3://boot-images/da370218-b174-4b48-bdb1-f85d0b5fbccb/rootfs",
                     "type": "s3"
                 },
-                "name": "image_that_has_been_uploaded"
+                "md5": rootfs_md5,
+                "type": "application/vnd.cray.image.rootfs.squashfs"
             },
             {
-                "created": "2022-01-01T00:00:00.00000+00:00",
-                "id": "d8a34ae4-ff5d-4ff7-b625-27e89006a428",
-                "name": "image_created_but_not_uploaded"
-            },
-        ]
-        self.new_ims_image = {
-            "created": "2022-01-01T00:00:00.00000+00:00",
-            "id": "602f9848-835c-49c8-833c-0fd4bb5c526f",
-            "name": "newly_created_image"
-        }
-
-        self.rootfs = 'rootfs.squashfs'
-        self.kernel = 'vmlinuz'
-        self.initrd = 'barebones.initrd'
-
-        self.rootfs_md5 = "29f6a020e682ea8ef6f7728cc8e055a3"
-        self.kernel_md5 = "6fc418e57f3d86c9b66e522f74cc1909"
-        self.initrd_md5 = "42488bf5d1400e6f563a39aab66292a6"
-        self.debug_md5 = "213c06c51ed7df6f08e02866c7758cb8"
-        self.params_md5 = "88e292b9447efefa8460bb2b17d043c0"
-        self.manifest = {
-            "artifacts": [
-                {
-                    "link": {
-                        "etag": self.rootfs_md5,
-                        "path": "s3://boot-images/da370218-b174-4b48-bdb1-f85d0b5fbccb/rootfs",
-                        "type": "s3"
-                    },
-                    "md5": self.rootfs_md5,
-                    "type": "application/vnd.cray.image.rootfs.squashfs"
-                },
-                {
-                    "link": {
-                        "etag": self.kernel_md5,
-                        "path": "s3://boot-images/da370218-b174-4b48-bdb1-f85d0b5fbccb/kernel",
-                        "type": "s3"
-                    },
-                    "md5": self.kernel_md5,
-                    "type": "application/vnd.cray.image.kernel"
+                "link": {
+                    "etag": kernel_md5,
+                    "path": "s3://boot-images/da370218-b174-4b48-bdb1-f85d0b5fbccb/kernel",
+                    "type": "s3"
                 },
-                {
-                    "link": {
-                        "etag": self.initrd_md5,
-                        "path": "s3://boot-images/da370218-b174-4b48-bdb1-f85d0b5fbccb/initrd",
-                        "type": "s3"
-                    },
-                    "md5": self.initrd_md5,
-                    "type": "application/vnd.cray.image.initrd"
+                "md5": kernel_md5,
+                "type": "application/vnd.cray.image.kernel"
+            },
+            {
+                "link": {
+                    "etag": initrd_md5,
+                    "path": "s3://boot-images/da370218-b174-4b48-bdb1-f85d0b5fbccb/initrd",
+                    "type": "s3"
                 },
-                {
-                    "link": {
-                        "etag": self.debug_md5,
-                        "path": "s3://boot-images/da370218-b174-4b48-bdb1-f85d0b5fbccb/debug_kernel",
-                        "type": "s3"
-                    },
-                    "md5": self.debug_md5,
-                    "type": "application/vnd.cray.image.debug.kernel",
+                "md5": initrd_md5,
+                "type": "application/vnd.cray.image.initrd"
+            },
+            {
+                "link": {
+                    "etag": debug_md5,
+                    "path": "s3://boot-images/da370218-b174-4b48-bdb1-f85d0b5fbccb/debug_kernel",
+                    "type": "s3"
                 },
-                {
-                    "link": {
-                        "etag": self.params_md5,
-                        "path": "s3://boot-images/da370218-b174-4b48-bdb1-f85d0b5fbccb/boot_parameters",
-                        "type": "s3"
-                    },
-                    "md5": self.params_md5,
-                    "type": "application/vnd.cray.image.parameters.boot",
+                "md5": debug_md5,
+                "type": "application/vnd.cray.image.debug.kernel",
+            },
+            {
+                "link": {
+                    "etag": params_md5,
+                    "path": "s3://boot-images/da370218-b174-4b48-bdb1-f85d0b5fbccb/boot_parameters",
+                    "type": "s3"
                 },
-            ],
-            "created": "2023-02-07 21:38:50.567059",
-            "version": "1.0"
-        }
+                "md5": params_md5,
+                "type": "application/vnd.cray.image.parameters.boot",
+            },
+        ],
+        "created": "2023-02-07 21:38:50.567059",
+        "version": "1.0"
+    }
+    manifest_bytes = json.dumps(manifest).encode()
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Building an ImsHelper sets up boto3 clients, which is slow; the
+        # tests only patch it within their own scope, so share one per class.
+        cls.session = requests.session()
+        cls.ims_helper = ImsHelper(cls.ims_url, cls.session)
+
+    def setUp(self):
+        super().setUp()
+        # Drop the responses registered by the test so they do not leak
+        self.addCleanup(_RMOCK.reset)
+
+        self.test_image_job_id = str(uuid.uuid4())
+
+    def start_patch(self, patcher):
+        """ Start patcher, undoing it once the test is done since ims_helper is shared """
+        mocked = patcher.start()
+        self.addCleanup(patcher.stop)
+        return mocked
 
 
 class TestImage(BaseTestImage):
-    @responses.activate
     def test_image_set_job_status(self):
         """ Test image_upload_artifacts method of the IMS Helper class """
 
-        def patch_ims_job_response(request):
-            payload = json.loads(request.body)
-            resp_body = {
-                'artifact_id': str(uuid.uuid4()),
-                'build_env_size': '10',
-                'created': '2018-11-16T21:18:56.306420+00:00',
-                'id': request.path_url[15:]
-            }
-            if 'resultant_image_id' in payload:
-                resp_body['resultant_image_id'] = payload['resultant_image_id']
-            if 'status' in payload:
-                resp_body['status'] = payload['status']
-            return 200, {}, json.dumps(resp_body)
-
-        patch_url = '{}/jobs/{}'.format(self.ims_url, self.test_image_job_id)
-        responses.add_callback(
+        patch_url = '{}/{}'.format(self.jobs_url, self.test_image_job_id)
+        ims_job_record = {
+            'artifact_id': str(uuid.uuid4()),
+            'build_env_size': '10',
+            'created': '2018-11-16T21:18:56.306420+00:00',
+            'id': self.test_image_job_id,
+            'status': self.test_job_status,
+        }
+        _RMOCK.add(
             responses.PATCH,
             patch_url,
-            callback=patch_ims_job_response,
-            content_type="application/json"
+            json=ims_job_record,
+            match=[responses.matchers.json_params_matcher({'status': self.test_job_status})]
         )
 
-        responses.add(
-            responses.GET, '{}/version'.format(self.ims_url), json={"version": "1.2.3"})
-
-        result = ImsHelper(self.ims_url, self.session).image_set_job_status(
+        result = self.ims_helper.image_set_job_status(
             self.test_image_job_id,
             self.test_job_status
         )
 
-        self.assertItemsEqual(result.keys(),
-                              ['result', 'ims_job_record'],
-                              'returned keys not the same')
+        self.assertEqual(set(result.keys()),
+                         {'result', 'ims_job_record'},
+                         'returned keys not the same')
         self.assertEqual(result['result'], 'success')
         self.assertEqual(self.test_image_job_id, result['ims_job_record']['id'])
         self.assertEqual(result['ims_job_record']['status'], self.test_job_status)
 
-    @responses.activate
     def test_get_empty_image_record_for_new_image(self):
         """Test images are created when getting an empty image that doesn't exist"""
-        responses.add(
-            responses.GET, f'{self.ims_url}/images', json=self.existing_ims_images
+        _RMOCK.add(
+            responses.GET, self.images_url, json=self.existing_ims_images
         )
-        responses.add(responses.POST, f'{self.ims_url}/images', status=201, json=self.new_ims_image)
-        result = ImsHelper(self.ims_url, self.session).get_empty_image_record_for_name('newly_created_image', skip_existing=True)
+        _RMOCK.add(responses.POST, self.images_url, status=201, json=self.new_ims_image)
+        result = self.ims_helper.get_empty_image_record_for_name('newly_created_image', skip_existing=True)
         assert result == self.new_ims_image
 
-    @responses.activate
     def test_get_empty_image_record_for_existing_empty_image(self):
         """Test images are not uploaded when an empty image of the same name already exists in IMS."""
-        responses.add(
-            responses.GET, f'{self.ims_url}/images', json=self.existing_ims_images
+        _RMOCK.add(
+            responses.GET, self.images_url, json=self.existing_ims_images
         )
-        responses.add(responses.POST, f'{self.ims_url}/images', status=201)
-        result = ImsHelper(self.ims_url, self.session).get_empty_image_record_for_name('image_created_but_not_uploaded', skip_existing=True)
+        _RMOCK.add(responses.POST, self.images_url, status=201)
+        result = self.ims_helper.get_empty_image_record_for_name('image_created_but_not_uploaded', skip_existing=True)
         assert result == self.existing_ims_images[1]
 
     def test_get_existing_image_record(self):
@@ -217,177 +239,338 @@ class TestImage(BaseTestImage):
         image_name = self.new_ims_image['name']
         with mock.patch('ims_python_helper.ImsHelper.get_empty_image_record_for_name',
                         return_value=self.new_ims_image):
-            result = ImsHelper(self.ims_url, self.session).image_upload_artifacts(image_name, skip_existing=False)
+            result = self.ims_helper.image_upload_artifacts(image_name, skip_existing=False)
             self.assertEqual(result['ims_image_record'], self.new_ims_image)
 
-    @responses.activate
+    def test_image_upload_artifacts_keeps_artifact_order(self):
+        """Test that artifacts uploaded in parallel are reported in the order they were given"""
+        def fake_artifact_processor(artifact_type, key, _artifact, **_kwargs):
+            return {
+                'link': {'path': 's3://boot-images/{}'.format(key), 'etag': 'etag', 'type': 's3'},
+                'type': artifact_type,
+                'md5': 'md5',
+            }
+
+        ims_helper = self.ims_helper
+        with mock.patch.object(ims_helper, 'get_empty_image_record_for_name', return_value=self.new_ims_image), \
+                mock.patch.object(ims_helper, '_artifact_processor', side_effect=fake_artifact_processor), \
+                mock.patch.object(ims_helper, '_ims_image_patch', return_value=self.new_ims_image):
+            result = ims_helper.image_upload_artifacts(
+                self.new_ims_image['name'], rootfs=[self.rootfs], kernel=[self.kernel], initrd=[self.initrd]
+            )
+
+        self.assertEqual(
+            [artifact['type'] for artifact in result['ims_image_artifacts']],
+            [SQUASHFS_ARTIFACT_TYPE, KERNEL_ARTIFACT_TYPE, INITRD_ARTIFACT_TYPE, 'application/json']
+        )
+
+    def test_image_upload_artifacts_cleans_up_on_failure(self):
+        """Test that the image is removed when one of the parallel uploads fails"""
+        def fake_artifact_processor(artifact_type, key, _artifact, **_kwargs):
+            if artifact_type == KERNEL_ARTIFACT_TYPE:
+                raise botocore.exceptions.ClientError({}, "PutObject")
+            return {'link': {'path': key, 'etag': 'etag', 'type': 's3'}, 'type': artifact_type, 'md5': 'md5'}
+
+        ims_helper = self.ims_helper
+        with mock.patch.object(ims_helper, 'get_empty_image_record_for_name', return_value=self.new_ims_image), \
+                mock.patch.object(ims_helper, '_artifact_processor', side_effect=fake_artifact_processor), \
+                mock.patch.object(ims_helper, '_ims_image_delete') as mock_image_delete, \
+                mock.patch.object(ims_helper, 's3_resource'):
+            self.assertRaises(
+                botocore.exceptions.ClientError, ims_helper.image_upload_artifacts,
+                self.new_ims_image['name'], rootfs=[self.rootfs], kernel=[self.kernel], initrd=[self.initrd]
+            )
+        mock_image_delete.assert_called_once_with(self.new_ims_image['id'])
+
+    def test_image_upload_artifacts_hashes_artifacts_once(self):
+        """Test that checksums from comparing existing images are reused for the upload"""
+        existing_images = [dict(self.existing_ims_images[0], id=str(uuid.uuid4()), name='name') for _ in range(2)]
+        manifest_meta = {'link': {'path': 'manifest', 'etag': 'etag', 'type': 's3'}, 'type': 'application/json'}
+        ims_helper = self.ims_helper
+        with mock.patch.object(ims_helper, 'get_empty_image_record_for_name',
+                               side_effect=ImsImagesExistWithName('name', existing_images)), \
+                mock.patch.object(ims_helper, 'get_image_manifest',
+                                  return_value=dict(self.manifest, artifacts=self.manifest['artifacts'][:2])), \
+                mock.patch.object(ims_helper, '_md5', side_effect=lambda path: 'local_' + path) as mock_md5, \
+                mock.patch.object(ims_helper, '_ims_image_create', return_value=self.new_ims_image), \
+                mock.patch.object(ims_helper, '_artifact_processor', return_value=manifest_meta) as mock_processor, \
+                mock.patch.object(ims_helper, '_ims_image_patch', return_value=self.new_ims_image):
+            ims_helper.image_upload_artifacts(
+                'name', rootfs=[self.rootfs], kernel=[self.kernel], skip_existing=True
+            )
+
+        self.assertEqual(2, mock_md5.call_count)
+        upload_md5s = {
+            c.args[2]: c.kwargs['md5sum'] for c in mock_processor.call_args_list if c.args[0] != 'application/json'
+        }
+        self.assertEqual({self.rootfs: 'local_' + self.rootfs, self.kernel: 'local_' + self.kernel}, upload_md5s)
+
+    def test_image_upload_artifacts_presigned(self):
+        """Test that a presigned PUT is returned for each artifact, signed with its metadata"""
+        image_id = self.new_ims_image['id']
+        ims_helper = ImsHelper(self.ims_url, self.session, s3_bucket='boot-images')
+        with mock.patch.object(ims_helper, '_ims_image_create', return_value=self.new_ims_image), \
+                mock.patch.object(ims_helper, 's3_client') as mock_s3_client:
+            mock_s3_client.generate_presigned_url.side_effect = \
+                lambda _method, Params, ExpiresIn: 'https://s3/{}'.format(Params['Key'])
+            result = ims_helper.image_upload_artifacts_presigned(
+                self.new_ims_image['name'],
+                {SQUASHFS_ARTIFACT_TYPE: self.rootfs_md5, KERNEL_ARTIFACT_TYPE: self.kernel_md5},
+                ims_job_id=self.test_image_job_id
+            )
+
+        self.assertEqual(self.new_ims_image, result['ims_image_record'])
+        rootfs_upload = result['uploads'][SQUASHFS_ARTIFACT_TYPE]
+        self.assertEqual('https://s3/{}/rootfs'.format(image_id), rootfs_upload['url'])
+        self.assertEqual(self.rootfs_md5, rootfs_upload['headers']['x-amz-meta-md5sum'])
+        self.assertEqual(image_id, rootfs_upload['headers']['x-amz-meta-x-shasta-ims-image-id'])
+        self.assertEqual(self.test_image_job_id, rootfs_upload['headers']['x-amz-meta-x-shasta-ims-job-id'])
+        self.assertEqual('https://s3/{}/kernel'.format(image_id), result['uploads'][KERNEL_ARTIFACT_TYPE]['url'])
+
+    def test_finalize_image(self):
+        """Test that finalize_image builds the manifest from the uploaded objects and links it"""
+        image_id = self.new_ims_image['id']
+        manifest_meta = {'link': {'path': 'manifest', 'etag': 'etag', 'type': 's3'}, 'type': 'application/json'}
+        ims_helper = ImsHelper(self.ims_url, self.session, s3_bucket='boot-images')
+        with mock.patch.object(ims_helper, 's3_client') as mock_s3_client, \
+                mock.patch.object(ims_helper, '_artifact_processor', return_value=manifest_meta), \
+                mock.patch.object(ims_helper, '_ims_image_patch', return_value=self.new_ims_image) as mock_patch:
+            mock_s3_client.head_object.return_value = {
+                'ETag': '"{}"'.format(self.kernel_md5), 'Metadata': {'md5sum': self.kernel_md5}
+            }
+            result = ims_helper.finalize_image(image_id, [KERNEL_ARTIFACT_TYPE])
+
+        self.assertEqual(
+            [{
+                'link': {'path': 's3://boot-images/{}/kernel'.format(image_id), 'etag': self.kernel_md5, 'type': 's3'},
+                'type': KERNEL_ARTIFACT_TYPE,
+                'md5': self.kernel_md5,
+            }, manifest_meta],
+            result['ims_image_artifacts']
+        )
+        mock_patch.assert_called_once_with(image_id, {'link': manifest_meta['link']})
+
     def test_get_empty_image_record_for_existing_uploaded_image(self):
         """Test images are not uploaded when a populated image of the same name already exists in IMS."""
-        responses.add(
-            responses.GET, f'{self.ims_url}/images', json=self.existing_ims_images
+        _RMOCK.add(
+            responses.GET, self.images_url, json=self.existing_ims_images
         )
-        responses.add(responses.POST, f'{self.ims_url}/images', status=201)
+        _RMOCK.add(responses.POST, self.images_url, status=201)
 
         def should_raise():
-            ImsHelper(self.ims_url, self.session).get_empty_image_record_for_name('image_that_has_been_uploaded', skip_existing=True)
+            self.ims_helper.get_empty_image_record_for_name('image_that_has_been_uploaded', skip_existing=True)
 
         self.assertRaises(ImsImagesExistWithName, should_raise)
 
-    @responses.activate
     def test_ims_recipes_get(self):
         """ Test _ims_recipes_get method when get a valid response from IMS. """
         exp_recipes = [{'name': 'example'}]
-        responses.add(
-            responses.GET, '{}/recipes'.format(self.ims_url), json=exp_recipes)
-        responses.add(
-            responses.GET, '{}/version'.format(self.ims_url), json={"version": "1.2.3"})
-        responses.add(
-            responses.GET, '{}/version'.format(self.ims_url), json={"version": "1.2.3"})
-
-        ims_helper = ImsHelper(self.ims_url, self.session)
+        _RMOCK.add(
+            responses.GET, self.recipes_url, json=exp_recipes)
+
+        ims_helper = self.ims_helper
         recipes = ims_helper._ims_recipes_get()
         self.assertEqual(exp_recipes, recipes)
 
-    @responses.activate
-    def test_ims_recipes_get_error(self):
-        """ Test _ims_recipes_get method when get an invalid response from IMS. """
-        exp_error = {'title': 'Not Found'}
-        responses.add(
-            responses.GET, '{}/recipes'.format(self.ims_url), json=exp_error,
-            status=404)
-        responses.add(
-            responses.GET, '{}/version'.format(self.ims_url), json={"version": "1.2.3"})
-
-        ims_helper = ImsHelper(self.ims_url, self.session)
-        self.assertRaises(
-            requests.exceptions.HTTPError, ims_helper._ims_recipes_get)
-
-    @responses.activate
-    def test_ims_recipe_create(self):
-        """ Test _ims_recipe_create method when get a valid response from IMS. """
+    def test_ims_recipes_get_by_name(self):
+        """ Test _ims_recipes_get method asks IMS for recipes with the given name. """
+        exp_recipes = [{'name': 'example'}]
+        _RMOCK.add(
+            responses.GET, self.recipes_url, json=exp_recipes,
+            match=[responses.matchers.query_param_matcher({'name': 'example'})])
 
-        recipe_name = str(mock.sentinel.name)
+        ims_helper = self.ims_helper
+        recipes = ims_helper._ims_recipes_get(name='example')
+        self.assertEqual(exp_recipes, recipes)
 
-        fake_recipe_data = {'name': recipe_name}
-        responses.add(responses.POST, '{}/recipes'.format(self.ims_url),
-                      json=fake_recipe_data)
+    def test_ims_url_trailing_slash(self):
+        """ Test that a trailing slash on the IMS URL does not end up in request URLs. """
+        _RMOCK.add(responses.GET, self.images_url, json=[self.new_ims_image])
 
-        responses.add(
-            responses.GET, '{}/version'.format(self.ims_url), json={"version": "1.2.3"})
+        ims_helper = ImsHelper(self.ims_url + '/', self.session)
+        self.assertEqual(self.ims_url, ims_helper.ims_url)
+        self.assertEqual([self.new_ims_image], ims_helper._ims_images_get())
 
-        ims_helper = ImsHelper(self.ims_url, self.session)
+    def test_ims_images_get_by_name(self):
+        """ Test _ims_images_get method asks IMS for images with the given name. """
+        _RMOCK.add(
+            responses.GET, self.images_url, json=[self.new_ims_image],
+            match=[responses.matchers.query_param_matcher({'name': self.new_ims_image['name']})])
 
-        linux_distribution = str(mock.sentinel.linux_distribution)
-        resp = ims_helper._ims_recipe_create(
-            recipe_name, linux_distribution)
+        ims_helper = self.ims_helper
+        images = ims_helper._ims_images_get(name=self.new_ims_image['name'])
+        self.assertEqual([self.new_ims_image], images)
 
-        exp_req_data = {
-            'recipe_type': 'kiwi-ng',
-            'linux_distribution': linux_distribution,
-            'name': recipe_name,
-        }
-        self.assertEqual(
-            exp_req_data, json.loads(responses.calls[0].request.body))
-
-        self.assertEqual(fake_recipe_data, resp)
-
-    @responses.activate
-    def test_ims_recipe_create_with_template_dictionary(self):
+    def test_ims_recipe_create(self):
         """ Test _ims_recipe_create method when get a valid response from IMS. """
-
         recipe_name = str(mock.sentinel.name)
-
-        fake_recipe_data = {'name': recipe_name}
-        responses.add(responses.POST, '{}/recipes'.format(self.ims_url),
-                      json=fake_recipe_data)
-
-        responses.add(
-            responses.GET, '{}/version'.format(self.ims_url), json={"version": "1.2.3"})
-
-        ims_helper = ImsHelper(self.ims_url, self.session)
-
         linux_distribution = str(mock.sentinel.linux_distribution)
-        template_dictionary = {'CSM_VERSION': '1.0.0'}
-        resp = ims_helper._ims_recipe_create(
-            recipe_name, linux_distribution, template_dictionary)
-
-        exp_req_data = {
-            'recipe_type': 'kiwi-ng',
-            'linux_distribution': linux_distribution,
-            'template_dictionary': [{'key': k, 'value': v} for k, v in template_dictionary.items()],
-            'name': recipe_name,
-        }
-        self.assertEqual(
-            exp_req_data, json.loads(responses.calls[0].request.body))
-
-        self.assertEqual(fake_recipe_data, resp)
-
-    @responses.activate
-    def test_ims_recipe_create_error(self):
-        """ Test _ims_recipe_create method when get an invalid response from the server. """
-
-        fake_error_data = {'title': 'Bad Request'}
-        responses.add(responses.POST, '{}/recipes'.format(self.ims_url),
-                      json=fake_error_data, status=400)
-        responses.add(
-            responses.GET, '{}/version'.format(self.ims_url), json={"version": "1.2.3"})
+        fake_recipe_data = {'name': recipe_name}
 
-        ims_helper = ImsHelper(self.ims_url, self.session)
+        for template_dictionary in (None, {'CSM_VERSION': '1.0.0'}):
+            with self.subTest(template_dictionary=template_dictionary):
+                _RMOCK.reset()
+                _RMOCK.add(responses.POST, self.recipes_url, json=fake_recipe_data)
+
+                resp = self.ims_helper._ims_recipe_create(
+                    recipe_name, linux_distribution, template_dictionary)
+
+                exp_req_data = {
+                    'recipe_type': 'kiwi-ng',
+                    'linux_distribution': linux_distribution,
+                    'name': recipe_name,
+                }
+                if template_dictionary:
+                    exp_req_data['template_dictionary'] = [
+                        {'key': k, 'value': v} for k, v in template_dictionary.items()
+                    ]
+                self.assertEqual(
+                    exp_req_data, json.loads(_RMOCK.calls[0].request.body))
+                self.assertEqual(fake_recipe_data, resp)
 
-        recipe_name = str(mock.sentinel.name)
-        linux_distribution = str(mock.sentinel.linux_distribution)
-        self.assertRaises(
-            requests.exceptions.HTTPError, ims_helper._ims_recipe_create,
-            recipe_name, linux_distribution)
-
-    @responses.activate
     def test_ims_recipe_delete(self):
         """ Test _ims_recipe_delete method when get a valid response from IMS. """
         recipe_id = str(uuid.uuid4())
-        responses.add(
-            responses.DELETE, '{}/recipes/{}'.format(self.ims_url, recipe_id))
-        responses.add(
-            responses.GET, '{}/version'.format(self.ims_url), json={"version": "1.2.3"})
+        _RMOCK.add(
+            responses.DELETE, '{}/{}'.format(self.recipes_url, recipe_id))
 
-        ims_helper = ImsHelper(self.ims_url, self.session)
+        ims_helper = self.ims_helper
         ims_helper._ims_recipe_delete(recipe_id)
 
-    @responses.activate
-    def test_ims_recipe_delete_error(self):
-        """ Test _ims_recipe_delete method when get an invalid response from IMS. """
+    def test_ims_recipe_errors(self):
+        """ Test the recipe methods raise when they get an invalid response from IMS. """
         recipe_id = str(uuid.uuid4())
-        responses.add(
-            responses.DELETE, '{}/recipes/{}'.format(self.ims_url, recipe_id),
-            status=404)
-        responses.add(
-            responses.GET, '{}/version'.format(self.ims_url), json={"version": "1.2.3"})
+        cases = [
+            (responses.GET, self.recipes_url, 404, self.ims_helper._ims_recipes_get, ()),
+            (responses.POST, self.recipes_url, 400, self.ims_helper._ims_recipe_create,
+             (str(mock.sentinel.name), str(mock.sentinel.linux_distribution))),
+            (responses.DELETE, '{}/{}'.format(self.recipes_url, recipe_id), 404, self.ims_helper._ims_recipe_delete,
+             (recipe_id,)),
+        ]
+        for method, url, status, func, args in cases:
+            with self.subTest(method=func.__name__):
+                _RMOCK.reset()
+                _RMOCK.add(method, url, json={'title': 'Error'}, status=status)
+                self.assertRaises(requests.exceptions.HTTPError, func, *args)
+
+    def test_artifact_processor_puts_small_artifact(self):
+        """ Test that small artifacts are uploaded with one PUT and no follow-up HEAD. """
+        with tempfile.NamedTemporaryFile() as artifact:
+            artifact.write(b'boot parameters')
+            artifact.flush()
+
+            ims_helper = ImsHelper(self.ims_url, self.session, s3_bucket='boot-images')
+            with mock.patch.object(ims_helper, 's3_client') as mock_s3_client:
+                mock_s3_client.put_object.return_value = {'ETag': '"%s"' % self.params_md5}
+                result = ims_helper._artifact_processor(
+                    BOOT_PARAMS_ARTIFACT_TYPE, 'image_id/boot_parameters', artifact.name, md5sum=self.params_md5
+                )
+
+        mock_s3_client.upload_file.assert_not_called()
+        mock_s3_client.head_object.assert_not_called()
+        self.assertEqual(self.params_md5, result['link']['etag'])
+        self.assertEqual(self.params_md5, result['md5'])
+        self.assertEqual('s3://boot-images/image_id/boot_parameters', result['link']['path'])
+
+    def test_artifact_processor_uploads_bytes(self):
+        """ Test that an artifact given as bytes is hashed and uploaded from memory. """
+        body = b'{"version": "1.0"}'
+        body_md5 = hashlib.md5(body).hexdigest()
+        ims_helper = ImsHelper(self.ims_url, self.session, s3_bucket='boot-images')
+        with mock.patch.object(ims_helper, 's3_client') as mock_s3_client:
+            mock_s3_client.put_object.side_effect = \
+                lambda **kwargs: {'ETag': '"%s"' % hashlib.md5(kwargs['Body'].read()).hexdigest()}
+            result = ims_helper._artifact_processor('application/json', 'image_id/manifest.json', body)
+
+        self.assertEqual(body_md5, result['md5'])
+        self.assertEqual(body_md5, result['link']['etag'])
+        self.assertEqual({'md5sum': body_md5}, mock_s3_client.put_object.call_args.kwargs['Metadata'])
+
+    def test_artifact_processor_gives_up_after_retries(self):
+        """ Test that an upload that keeps failing is retried a bounded number of times. """
+        with tempfile.NamedTemporaryFile() as artifact:
+            artifact.write(b'boot parameters')
+            artifact.flush()
+
+            ims_helper = ImsHelper(self.ims_url, self.session, s3_bucket='boot-images')
+            with mock.patch.object(ims_helper, 's3_client') as mock_s3_client, \
+                    mock.patch('ims_python_helper.sleep') as mock_sleep:
+                mock_s3_client.put_object.side_effect = botocore.exceptions.ClientError(
+                    {'Error': {'Code': 'SlowDown'}, 'ResponseMetadata': {'HTTPStatusCode': 503}}, "PutObject")
+                self.assertRaises(
+                    botocore.exceptions.ClientError, ims_helper._artifact_processor,
+                    BOOT_PARAMS_ARTIFACT_TYPE, 'image_id/boot_parameters', artifact.name, md5sum=self.params_md5
+                )
+
+        self.assertEqual(5, mock_s3_client.put_object.call_count)
+        self.assertEqual(4, mock_sleep.call_count)
+
+    def test_artifact_processor_does_not_retry_permanent_errors(self):
+        """ Test that an upload failing with an error retrying cannot fix is not retried. """
+        with tempfile.NamedTemporaryFile() as artifact:
+            artifact.write(b'boot parameters')
+            artifact.flush()
+
+            ims_helper = ImsHelper(self.ims_url, self.session, s3_bucket='boot-images')
+            with mock.patch.object(ims_helper, 's3_client') as mock_s3_client, \
+                    mock.patch('ims_python_helper.sleep') as mock_sleep:
+                mock_s3_client.put_object.side_effect = botocore.exceptions.ClientError(
+                    {'Error': {'Code': 'AccessDenied'}, 'ResponseMetadata': {'HTTPStatusCode': 403}}, "PutObject")
+                self.assertRaises(
+                    botocore.exceptions.ClientError, ims_helper._artifact_processor,
+                    BOOT_PARAMS_ARTIFACT_TYPE, 'image_id/boot_parameters', artifact.name, md5sum=self.params_md5
+                )
+
+        self.assertEqual(1, mock_s3_client.put_object.call_count)
+        mock_sleep.assert_not_called()
+
+    def test_recipe_upload_hashes_recipe_once(self):
+        """ Test recipe_upload hashes the archive once and reuses the md5sum for the upload. """
+        recipe_name = 'example'
+        existing_recipes = [
+            {'id': str(uuid.uuid4()), 'name': recipe_name, 'link': {'path': 's3://ims/recipe.tar.gz'}}
+            for _ in range(2)
+        ]
+        new_recipe = {'id': str(uuid.uuid4()), 'name': recipe_name}
+        recipe_meta = {'link': {'path': 's3://ims/recipes/recipe.tar.gz', 'etag': 'etag', 'type': 's3'}}
+
+        ims_helper = self.ims_helper
+        with mock.patch.object(ims_helper, '_ims_recipes_get', return_value=existing_recipes), \
+                mock.patch.object(ims_helper, 's3_client') as mock_s3_client, \
+                mock.patch.object(ims_helper, '_md5', return_value='local_md5') as mock_md5, \
+                mock.patch.object(ims_helper, '_ims_recipe_create', return_value=new_recipe), \
+                mock.patch.object(ims_helper, '_artifact_processor', return_value=recipe_meta) as mock_processor, \
+                mock.patch.object(ims_helper, '_ims_recipe_patch', return_value=new_recipe):
+            mock_s3_client.head_object.return_value = {'Metadata': {'md5sum': 'remote_md5'}}
+            result = ims_helper.recipe_upload(recipe_name, '/path/to/recipe.tar.gz', 'sles15')
 
-        ims_helper = ImsHelper(self.ims_url, self.session)
-        self.assertRaises(
-            requests.exceptions.HTTPError, ims_helper._ims_recipe_delete,
-            recipe_id)
+        self.assertEqual(new_recipe, result)
+        mock_md5.assert_called_once_with('/path/to/recipe.tar.gz')
+        self.assertEqual('local_md5', mock_processor.call_args.kwargs['md5sum'])
+        self.assertEqual(2, mock_s3_client.head_object.call_count)
 
 
 class TestDuplicateImages(BaseTestImage):
     def setUp(self):
         super().setUp()
-        self.ims_helper = ImsHelper(self.ims_url, self.session)
-
-        self.mock_get_image_manifest = patch.object(
+        self.mock_get_image_manifest = self.start_patch(patch.object(
             self.ims_helper,
             'get_image_manifest',
-            return_value=self.manifest).start()
-        self.mock_md5 = patch.object(
+            return_value=self.manifest))
+        # Artifacts may be hashed concurrently, so look md5sums up by path
+        # rather than relying on the order of the calls.
+        self.artifact_md5s = {
+            '/path/to/rootfs': self.rootfs_md5,
+            '/path/to/kernel': self.kernel_md5,
+            '/path/to/initrd': self.initrd_md5,
+            '/path/to/debug/kernel': self.debug_md5,
+            '/path/to/boot/parameters': self.params_md5,
+        }
+        self.mock_md5 = self.start_patch(patch.object(
             self.ims_helper,
             '_md5',
-            side_effect=[
-                self.rootfs_md5,
-                self.kernel_md5,
-                self.initrd_md5,
-                self.debug_md5,
-                self.params_md5
-            ]
-        ).start()
+            side_effect=lambda path: self.artifact_md5s[path]
+        ))
 
     def test_compare_image_manifest_matches(self):
         """Test that artifacts that match existing image records are detected"""
@@ -404,7 +587,9 @@ class TestDuplicateImages(BaseTestImage):
 
     def test_compare_image_manifest_does_not_match(self):
         """Test that artifacts that don't match are not returned as matches"""
-        self.mock_md5.side_effect = ["ba0bab", "deadc0de", "c0ffee", "badcode", "b0bacafe"]
+        self.artifact_md5s = dict(zip(
+            self.artifact_md5s, ["ba0bab", "deadc0de", "c0ffee", "badcode", "b0bacafe"]
+        ))
         result = self.ims_helper.artifacts_match_image_record(
             self.existing_ims_images[1],
             self.existing_ims_images[1]['name'],
@@ -416,24 +601,59 @@ class TestDuplicateImages(BaseTestImage):
         )
         self.assertFalse(result)
 
+    def test_compare_image_manifest_size_mismatch_skips_hashing(self):
+        """Test that an artifact whose size differs from the S3 object is not hashed"""
+        with tempfile.NamedTemporaryFile() as rootfs, \
+                patch.object(self.ims_helper, 's3_client') as mock_s3_client:
+            rootfs.write(b'rootfs')
+            rootfs.flush()
+            mock_s3_client.head_object.return_value = {'ContentLength': 1024}
+            result = self.ims_helper.artifacts_match_image_record(
+                self.existing_ims_images[0],
+                self.existing_ims_images[0]['name'],
+                rootfs.name,
+                '/path/to/kernel',
+                '/path/to/initrd',
+                '/path/to/debug/kernel',
+                '/path/to/boot/parameters',
+            )
+        self.assertFalse(result)
+        self.mock_md5.assert_not_called()
+        mock_s3_client.head_object.assert_called_once_with(
+            Bucket='boot-images', Key='da370218-b174-4b48-bdb1-f85d0b5fbccb/rootfs'
+        )
+
+    def test_compare_image_manifest_artifact_types_mismatch(self):
+        """Test that an image with different kinds of artifacts is rejected without hashing"""
+        result = self.ims_helper.artifacts_match_image_record(
+            self.existing_ims_images[0],
+            self.existing_ims_images[0]['name'],
+            '/path/to/rootfs',
+            '/path/to/kernel',
+        )
+        self.assertFalse(result)
+        self.mock_md5.assert_not_called()
+
 
 class TestRetrievingManifest(BaseTestImage):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Patch the shared S3 client once; setUp points it at this test
+        patcher = patch.object(cls.ims_helper.s3_client, 'get_object')
+        cls.mock_s3_get_object = patcher.start()
+        cls.addClassCleanup(patcher.stop)
+
     def setUp(self):
         super().setUp()
-        self.ims_helper = ImsHelper(self.ims_url, self.session)
-
         self.throw_error = False
+        self.mock_s3_get_object.reset_mock()
+        self.mock_s3_get_object.side_effect = self.mock_get_object
 
-        def mock_download_fileobj(bucket, path, buf):
-            if self.throw_error:
-                raise botocore.exceptions.ClientError({}, "GET")
-            else:
-                buf.write(json.dumps(self.manifest).encode())
-
-        self.mock_s3_client = patch.object(
-            self.ims_helper.s3_client,
-            'download_fileobj',
-            mock_download_fileobj).start()
+    def mock_get_object(self, Bucket, Key):  # pylint: disable=invalid-name,unused-argument
+        if self.throw_error:
+            raise botocore.exceptions.ClientError({}, "GET")
+        return {'Body': io.BytesIO(self.manifest_bytes)}
 
     def test_retrieve_manifest_successful(self):
         """Test retrieving the image manifest successfully"""